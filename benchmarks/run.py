@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import polytaxis_monitor.common as ptcommon
+
+from polytaxis_adventure.common import limit
+from polytaxis_adventure.pipeline import enrich, build_rows
+from polytaxis_adventure.table import compact
+from polytaxis_adventure.store import ResultStore
+from polytaxis_adventure.completion import CompletionIndex
+from polytaxis_adventure.stream import BatchSizer
+from polytaxis_adventure.launch import LauncherMatcher, LaunchCounts
+from synthetic import generate, SyntheticQueryDB
+
+sort = [('asc', 'k1'), ('desc', 'k2'), ('asc', 'filename')]
+
+# Launcher keys as they'd appear in launchers.json, some overlapping
+launch_keys = ['.mp3', '.mp3.p', '.p', '.ogg', '.flac', '.jpg', '.gz', '.tar.gz']
+
+results = []
+
+def timed(name, size, function):
+    start = time.perf_counter()
+    count = function()
+    seconds = time.perf_counter() - start
+    results.append({
+        'name': name,
+        'size': size,
+        'seconds': seconds,
+        'count': count,
+    })
+    print('{:>10} {:<28} {:>10.4f}s {}'.format(size, name, seconds, count),
+        file=sys.stderr)
+
+def batches(rows, size=100):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def run_query(db, includes, size):
+    raw = []
+    def query():
+        raw.extend(db.query(includes, set(), add_path=True))
+        return len(raw)
+    timed('query', size, query)
+
+    def first_row():
+        next(iter(db.query(includes, set(), add_path=True)), None)
+        return 1
+    timed('query first row', size, first_row)
+
+    timed('enrich', size, lambda: len([enrich(row) for row in raw]))
+
+    timed('ptcommon.sort', size, lambda: len(ptcommon.sort(sort, list(raw))))
+
+    rows = []
+    def pack():
+        for batch in batches(raw):
+            rows.extend(compact(batch))
+        return len(rows)
+    timed('compact', size, pack)
+
+    def launch():
+        counts = LaunchCounts()
+        counts.set_matcher(
+            LauncherMatcher({key: [] for key in launch_keys}))
+        for batch in batches(rows):
+            counts.add(batch)
+        return len(counts.matcher.key_counts(counts.counts))
+    timed('launch counts', size, launch)
+
+    def store():
+        store = ResultStore()
+        store.set_sort(sort)
+        for batch in batches(rows):
+            for position, keys, run in store.plan(batch):
+                store.insert(position, keys, run)
+        return len(store.rows)
+    timed('store insert', size, store)
+
+    def resort():
+        store = ResultStore()
+        for batch in batches(rows):
+            for position, keys, run in store.plan(batch):
+                store.insert(position, keys, run)
+        store.set_sort(sort)
+        return len(store.rows)
+    timed('store resort', size, resort)
+
+    return rows
+
+def run_display(rows, size):
+    from PyQt5.QtWidgets import QApplication, QTreeView
+    from polytaxis_adventure.model import ResultModel
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    def view():
+        model = ResultModel()
+        model.set_columns(['k1', 'k2', 'filename'])
+        model.store.set_sort(sort)
+        view = QTreeView()
+        view.setUniformRowHeights(True)
+        view.setModel(model)
+        view.resize(800, 600)
+        view.show()
+        return model, view
+
+    model, tree = view()
+    def display():
+        for batch in batches(rows):
+            model.insert(batch)
+            app.processEvents()
+        return model.rowCount()
+    timed('display insert', size, display)
+    tree.hide()
+
+    # Batches sized the way the display worker sizes them
+    model, tree = view()
+    def first():
+        model.insert(rows[:BatchSizer().first])
+        app.processEvents()
+        return model.rowCount()
+    timed('display first batch', size, first)
+    model, tree = view()
+    def stream():
+        sizer = BatchSizer()
+        start = 0
+        while start < len(rows):
+            batch = rows[start:start + (sizer.size() if start else sizer.first)]
+            start += len(batch)
+            batch_start = time.perf_counter()
+            model.insert(batch)
+            inserted = time.perf_counter()
+            app.processEvents()
+            sizer.measured(
+                len(batch), 
+                inserted - batch_start, 
+                time.perf_counter() - inserted,
+            )
+        return model.rowCount()
+    timed('display insert adaptive', size, stream)
+    tree.hide()
+
+def run_completion(db, size):
+    prefixes = ['k', 'k1', 'k1=', 'k1=v', 'k1=v1', 'f', 'fl', 'z']
+    def query_tags():
+        return sum(
+            len(list(limit(1000, build_rows(db, prefix))))
+            for prefix in prefixes
+        )
+    timed('query_tags x{}'.format(len(prefixes)), size, query_tags)
+    index = []
+    def build():
+        index.append(CompletionIndex(build_rows(db, '')))
+        return len(index[0].tags)
+    timed('completion build', size, build)
+    def complete():
+        count = 0
+        for repeat in range(100):
+            for prefix in prefixes:
+                count += len(index[0].complete(prefix))
+        return count
+    timed('completion x{}'.format(100 * len(prefixes)), size, complete)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the query, sort and display hot paths.')
+    parser.add_argument(
+        '--sizes', default='10000,100000',
+        help='Comma separated synthetic index sizes (files)')
+    parser.add_argument('--keys', type=int, default=8,
+        help='Tag keys per synthetic file')
+    parser.add_argument('--values', type=int, default=100,
+        help='Distinct values per synthetic tag key')
+    parser.add_argument('--workdir', default=tempfile.gettempdir(),
+        help='Where synthetic indexes are generated and reused')
+    parser.add_argument('--monitor', action='store_true',
+        help='Also time the real polytaxis-monitor index')
+    parser.add_argument('--include', action='append', default=[],
+        help='Include tag for the --monitor query')
+    parser.add_argument('--no-display', action='store_true',
+        help='Skip the Qt display benchmark')
+    parser.add_argument('--output', help='Write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        path = os.path.join(args.workdir, 'ptadventure-bench-{}-{}-{}.sqlite3'.format(
+            size, args.keys, args.values))
+        if not os.path.exists(path):
+            timed('generate', size,
+                lambda: generate(path, size, args.keys, args.values) or size)
+        db = SyntheticQueryDB(path)
+        rows = run_query(db, {'synthetic'}, size)
+        if not args.no_display:
+            run_display(rows, size)
+        run_completion(db, size)
+
+    if args.monitor:
+        db = ptcommon.QueryDB()
+        rows = run_query(db, set(args.include), 'monitor')
+        if not args.no_display:
+            run_display(rows, 'monitor')
+        run_completion(db, 'monitor')
+
+    out = json.dumps({
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'keys': args.keys,
+        'values': args.values,
+        'results': results,
+    }, indent=4)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(out)
+    else:
+        print(out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import random
+import sqlite3
+
+# A stand-in for a polytaxis-monitor index: same QueryDB interface and row
+# format, with its own minimal schema
+
+extensions = [
+    '.mp3', '.mp3.p', '.ogg', '.flac', '.m4a', '.jpg', '.png', '.txt',
+    '.tar.gz', '.pdf',
+]
+
+def generate(path, files, keys=8, values=100, seed=0):
+    if os.path.exists(path):
+        os.remove(path)
+    generator = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT);
+        CREATE TABLE tags (id INTEGER PRIMARY KEY, tag TEXT UNIQUE);
+        CREATE TABLE file_tags (file INTEGER, tag INTEGER);
+    ''')
+    tag_ids = {}
+    def tag_id(tag):
+        id = tag_ids.get(tag)
+        if id is None:
+            id = tag_ids[tag] = len(tag_ids) + 1
+        return id
+    file_rows = []
+    tag_rows = []
+    for file in range(files):
+        file_rows.append((file, '/synthetic/dir{}/sub{}/file{}{}'.format(
+            file % 97,
+            file % 13,
+            file,
+            generator.choice(extensions),
+        )))
+        tag_rows.append((file, tag_id('synthetic')))
+        for key in range(keys):
+            # Skewed so some values are much more common than others
+            value = int(generator.paretovariate(1.2)) % values
+            tag_rows.append((file, tag_id('k{}=v{}'.format(key, value))))
+        if generator.random() < 0.3:
+            tag_rows.append((file, tag_id('flagged')))
+        if len(tag_rows) > 100000:
+            conn.executemany('INSERT INTO file_tags VALUES (?, ?)', tag_rows)
+            tag_rows = []
+    conn.executemany('INSERT INTO file_tags VALUES (?, ?)', tag_rows)
+    conn.executemany('INSERT INTO files VALUES (?, ?)', file_rows)
+    conn.executemany(
+        'INSERT INTO tags VALUES (?, ?)',
+        [(id, tag) for tag, id in tag_ids.items()],
+    )
+    conn.executescript('''
+        CREATE INDEX file_tags_file ON file_tags (file);
+        CREATE INDEX file_tags_tag ON file_tags (tag, file);
+    ''')
+    conn.commit()
+    conn.close()
+
+class SyntheticQueryDB(object):
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+
+    def clear_cache(self):
+        pass
+
+    def query_tags(self, mode, arg):
+        if mode != 'prefix':
+            raise RuntimeError('Unsupported tag query mode {}'.format(mode))
+        for (tag,) in self.conn.execute(
+                'SELECT tag FROM tags WHERE tag >= ? AND tag < ? ORDER BY tag',
+                (arg, arg + '\U0010ffff')):
+            yield tag
+
+    def query(self, includes, excludes, add_path=False):
+        where = []
+        args = []
+        if includes:
+            where.append('''files.id IN (
+                SELECT file FROM file_tags JOIN tags ON tags.id = file_tags.tag
+                WHERE tags.tag IN ({}) GROUP BY file HAVING COUNT(*) = ?
+            )'''.format(', '.join('?' for tag in includes)))
+            args.extend(includes)
+            args.append(len(includes))
+        if excludes:
+            where.append('''files.id NOT IN (
+                SELECT file FROM file_tags JOIN tags ON tags.id = file_tags.tag
+                WHERE tags.tag IN ({})
+            )'''.format(', '.join('?' for tag in excludes)))
+            args.extend(excludes)
+        sql = 'SELECT id, path FROM files'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        for id, path in self.conn.execute(sql, args):
+            tags = {}
+            for (tag,) in self.conn.execute(
+                    'SELECT tags.tag FROM file_tags '
+                    'JOIN tags ON tags.id = file_tags.tag '
+                    'WHERE file_tags.file = ?', (id,)):
+                key, separator, value = tag.partition('=')
+                tags.setdefault(key, set()).add(value)
+            if add_path:
+                tags['path'] = {path}
+            yield {'tags': tags}
@@ -0,0 +1,67 @@
+import collections
+
+from .table import derived_keys, split_tag, has_tag
+
+class ResultCache(object):
+    def __init__(self, max_rows=200000):
+        self.max_rows = max_rows
+        self.entries = collections.OrderedDict()
+        self.rows = 0
+        self.stamp = None
+
+    def validate(self, stamp):
+        # True if the database changed since the last check
+        if stamp == self.stamp:
+            return False
+        changed = self.stamp is not None
+        self.stamp = stamp
+        self.entries.clear()
+        self.rows = 0
+        return changed
+
+    def get(self, includes, excludes):
+        key = (frozenset(includes), frozenset(excludes))
+        rows = self.entries.get(key)
+        if rows is not None:
+            self.entries.move_to_end(key)
+        return rows
+
+    def put(self, includes, excludes, rows):
+        key = (frozenset(includes), frozenset(excludes))
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.rows -= len(old)
+        if len(rows) > self.max_rows:
+            return
+        self.entries[key] = rows
+        self.rows += len(rows)
+        while self.rows > self.max_rows:
+            key, old = self.entries.popitem(last=False)
+            self.rows -= len(old)
+
+    def refine(self, includes, excludes, known):
+        # Filters the smallest cached superset in memory.  Only tags known to
+        # the index are matched here so partly typed values still go to the
+        # database.
+        best = None
+        for (cached_includes, cached_excludes), rows in self.entries.items():
+            if not (
+                    cached_includes <= includes and 
+                    cached_excludes <= excludes):
+                continue
+            if best is None or len(rows) < len(best[2]):
+                best = (cached_includes, cached_excludes, rows)
+        if best is None:
+            return None
+        more_includes = set(includes) - best[0]
+        more_excludes = set(excludes) - best[1]
+        for tag in more_includes | more_excludes:
+            if tag not in known or split_tag(tag)[0] in derived_keys:
+                return None
+        rows = [
+            row for row in best[2]
+            if all(has_tag(row, tag) for tag in more_includes) and
+            not any(has_tag(row, tag) for tag in more_excludes)
+        ]
+        self.put(includes, excludes, rows)
+        return rows
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import heapq
+import pickle
+import random
+import argparse
+import tempfile
+
+from .common import parse_elements
+from .store import sort_key
+from .settings import user_setting
+
+# Nothing here imports Qt, so scripts can run queries without a display
+
+# Sorted rows held in memory before a run is written to a temporary file
+sort_memory = 100000
+
+def _spill(records):
+    out = tempfile.TemporaryFile()
+    for record in records:
+        pickle.dump(record, out, protocol=pickle.HIGHEST_PROTOCOL)
+    out.seek(0)
+    return out
+
+def _unspill(source):
+    with source:
+        while True:
+            try:
+                yield pickle.load(source)
+            except EOFError:
+                return
+
+def external_sort(records, memory=sort_memory):
+    # records are (key, value); sorted runs past memory go to temporary files
+    # and are merged back, so memory stays bounded however many rows there are
+    first = lambda record: record[0]
+    runs = []
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= memory:
+            buffer.sort(key=first)
+            runs.append(_spill(buffer))
+            buffer = []
+    buffer.sort(key=first)
+    if not runs:
+        return iter(buffer)
+    return heapq.merge(
+        *([_unspill(run) for run in runs] + [buffer]), key=first)
+
+class _Row(object):
+    # A plain row with the get that sort_key expects.  Rows aren't compacted
+    # here, since the interned strings would last as long as the process.
+    __slots__ = ('tags',)
+
+    def __init__(self, row):
+        self.tags = row['tags']
+
+    def get(self, key):
+        # Ordered like a compacted row's values
+        return tuple(sorted(self.tags.get(key, ())))
+
+def query_rows(db, includes, excludes):
+    processes = user_setting('query_processes', 0)
+    if processes > 1:
+        from .shard import ShardPool
+        from .diskcache import unpack_tags
+        shards = ShardPool(processes)
+        work = shards.rows(db, includes, excludes, unpack=unpack_tags)
+        if work is not None:
+            try:
+                yield from map(_Row, work)
+            finally:
+                shards.shutdown()
+            return
+    from .pipeline import display_rows, enrich
+    for row in display_rows(db, includes, excludes):
+        yield _Row(enrich(row))
+
+def _tsv(value):
+    return (
+        value
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+    )
+
+def query(argv):
+    def element(type):
+        return lambda value: (type, value)
+    parser = argparse.ArgumentParser(
+        prog='polytaxis-adventure query',
+        description=(
+            'Query the polytaxis-monitor index without the GUI.  Elements '
+            'mean the same as in the query bar; sort and column elements '
+            'apply in the order given.'),
+    )
+    for flag, type, help in [
+            ('--include', 'inc', 'Only files with this tag'),
+            ('--exclude', 'exc', 'No files with this tag'),
+            ('--sort-asc', 'sort_asc', 'Sort ascending by this column'),
+            ('--sort-desc', 'sort_desc', 'Sort descending by this column'),
+            ('--sort-rand', 'sort_rand', 'Randomize by this column'),
+            ('--column', 'col', 'Show this column'),
+            ]:
+        parser.add_argument(
+            flag, dest='elements', action='append', type=element(type), 
+            default=[], help=help)
+    parser.add_argument('--format', choices=['tsv', 'json'], default='tsv',
+        help='Tab separated values or one JSON object per line')
+    parser.add_argument('--header', action='store_true',
+        help='Start TSV output with the column names')
+    parser.add_argument('--seed', type=int, 
+        help='Seed for --sort-rand, random if omitted')
+    args = parser.parse_args(argv)
+
+    includes, excludes, columns, sort = parse_elements(args.elements)
+    if not (includes or excludes):
+        parser.error('At least one --include or --exclude is needed')
+    if not columns:
+        columns = ['path']
+    seed = random.random() if args.seed is None else args.seed
+
+    import polytaxis_monitor.common as ptcommon
+    db = ptcommon.QueryDB()
+    records = (
+        (sort_key(sort, seed, row), [row.get(column) for column in columns])
+        for row in query_rows(db, includes, excludes)
+    )
+    if sort:
+        records = external_sort(records)
+
+    out = sys.stdout
+    try:
+        if args.format == 'tsv' and args.header:
+            out.write('\t'.join(_tsv(column) for column in columns) + '\n')
+        for key, values in records:
+            if args.format == 'tsv':
+                out.write('\t'.join(
+                    _tsv(', '.join(value)) for value in values) + '\n')
+            else:
+                out.write(json.dumps({
+                    column: list(value) 
+                    for column, value in zip(columns, values)
+                }) + '\n')
+        out.flush()
+    except BrokenPipeError:
+        # Output piped into head and the like; point stdout somewhere that
+        # won't fail again when it's flushed at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['query']:
+        return query(argv[1:])
+    from .main import main as gui_main
+    return gui_main()
+
+if __name__ == '__main__':
+    sys.exit(main())
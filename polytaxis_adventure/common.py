@@ -1,8 +1,30 @@
 def limit(maxcount, generator):                                                 
+    if maxcount <= 0:
+        return
     count = 0                                                                   
     for x in generator:                                                         
+        yield x 
+        count += 1                                                              
         if count >= maxcount:                                                   
             break                                                               
-        count += 1                                                              
-        yield x 
 
+def parse_elements(elements):
+    # (type, value) query elements to includes, excludes, columns and sort
+    includes = {value for type, value in elements if type == 'inc'}
+    excludes = {value for type, value in elements if type == 'exc'}
+    columns = []
+    sort = []
+    for type, value in elements:
+        if (
+                type in ('col', 'sort_asc', 'sort_desc', 'sort_rand') 
+                and value 
+                and value not in columns
+                ):
+            columns.append(value)
+        if type == 'sort_asc':
+            sort.append(('asc', value))
+        elif type == 'sort_desc':
+            sort.append(('desc', value))
+        elif type == 'sort_rand':
+            sort.append(('rand', value))
+    return includes, excludes, columns, sort
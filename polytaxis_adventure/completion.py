@@ -0,0 +1,77 @@
+import bisect
+import heapq
+import itertools
+
+class CompletionIndex(object):
+    def __init__(self, tags, stamp=None):
+        self.tags = sorted(set(tags))
+        # Database stamp when the tags were read
+        self.stamp = stamp
+        self.frequencies = {}
+        # Every tag, most frequent first, built when first needed after a
+        # change
+        self.ranked = None
+        self.last_prefix = None
+        self.last = None
+
+    def __contains__(self, tag):
+        index = bisect.bisect_left(self.tags, tag)
+        return index < len(self.tags) and self.tags[index] == tag
+
+    def update(self, frequencies):
+        for tag in frequencies:
+            if tag not in self.frequencies:
+                index = bisect.bisect_left(self.tags, tag)
+                if index == len(self.tags) or self.tags[index] != tag:
+                    self.tags.insert(index, tag)
+        self.frequencies.update(frequencies)
+        self.ranked = None
+        self.last_prefix = None
+        self.last = None
+
+    def change(self, added, removed):
+        for tag in removed:
+            index = bisect.bisect_left(self.tags, tag)
+            if index < len(self.tags) and self.tags[index] == tag:
+                del self.tags[index]
+            self.frequencies.pop(tag, None)
+        for tag in added:
+            index = bisect.bisect_left(self.tags, tag)
+            if index == len(self.tags) or self.tags[index] != tag:
+                self.tags.insert(index, tag)
+        self.ranked = None
+        self.last_prefix = None
+        self.last = None
+
+    def _frequency(self, tag):
+        return self.frequencies.get(tag, 0)
+
+    def complete(self, prefix, count=1000):
+        if self.last_prefix is not None and prefix.startswith(self.last_prefix):
+            # Narrowing the last prefix; filtering keeps the ranking
+            candidates = [tag for tag in self.last if tag.startswith(prefix)]
+            self.last_prefix = prefix
+            self.last = candidates
+            return candidates
+        start = bisect.bisect_left(self.tags, prefix)
+        end = bisect.bisect_left(self.tags, prefix + '\U0010ffff', start)
+        size = end - start
+        if size <= count:
+            candidates = sorted(
+                self.tags[start:end], key=self._frequency, reverse=True)
+            # Every candidate is kept, so narrower prefixes can filter them
+            self.last_prefix = prefix
+            self.last = candidates
+            return candidates
+        self.last_prefix = None
+        self.last = None
+        if size * size > count * len(self.tags):
+            # Enough tags match that the most frequent are found early in
+            # the ranked order
+            if self.ranked is None:
+                self.ranked = sorted(
+                    self.tags, key=self._frequency, reverse=True)
+            return list(itertools.islice(
+                (tag for tag in self.ranked if tag.startswith(prefix)), 
+                count))
+        return heapq.nlargest(count, self.tags[start:end], key=self._frequency)
@@ -0,0 +1,137 @@
+import os
+import struct
+import sqlite3
+
+# Everything that reaches past QueryDB's query methods into its sqlite3
+# connection goes through here
+
+def connection(db):
+    return db.conn
+
+def set_interrupt(db, check, interval=1000):
+    # sqlite calls check every interval VM instructions and aborts the
+    # running statement with OperationalError if it returns True
+    if check is None:
+        connection(db).set_progress_handler(None, 0)
+    else:
+        connection(db).set_progress_handler(check, interval)
+
+def is_interrupt(error):
+    return (
+        isinstance(error, sqlite3.OperationalError) and 
+        'interrupted' in str(error)
+    )
+
+def path(db):
+    for row in connection(db).execute('PRAGMA database_list'):
+        if row[1] == 'main':
+            return row[2]
+
+def watch_statements(db, callback):
+    # callback(sql, explain) for each statement run, with explain(sql) giving
+    # its EXPLAIN QUERY PLAN details from a second connection, since the
+    # first is still busy with the statement
+    explain_conn = sqlite3.connect(
+        'file:{}?mode=ro'.format(path(db)), uri=True)
+    def explain(sql):
+        return [
+            row[3] for row in 
+            explain_conn.execute('EXPLAIN QUERY PLAN ' + sql)
+        ]
+    connection(db).set_trace_callback(lambda sql: callback(sql, explain))
+
+def change_counter(path):
+    # The file change counter in the sqlite header, bumped by every commit
+    # outside WAL mode
+    try:
+        with open(path, 'rb') as db_file:
+            db_file.seek(24)
+            return struct.unpack('>I', db_file.read(4))[0]
+    except (OSError, struct.error):
+        return None
+
+def stamp(path):
+    # Changes whenever the monitor commits, whether or not it's in WAL mode
+    out = [change_counter(path)]
+    for suffix in ('', '-wal'):
+        try:
+            stat = os.stat(path + suffix)
+        except OSError:
+            out.append(None)
+            continue
+        out.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(out)
+
+def open_read_only(db, db_path=None):
+    # Replaces the connection with a read-only one to the same file (or
+    # db_path).  The temp schema stays writable.
+    conn = sqlite3.connect(
+        'file:{}?mode=ro'.format(db_path or path(db)), uri=True)
+    connection(db).close()
+    db.conn = conn
+
+def file_ids(db):
+    # First and last file id, or None if files can't be split by id
+    columns = {
+        row[1]: row for row in 
+        connection(db).execute('PRAGMA main.table_info(files)')
+    }
+    id = columns.get('id')
+    if id is None or not id[5] or id[2].upper() != 'INTEGER':
+        return None
+    low, high = connection(db).execute(
+        'SELECT min(id), max(id) FROM main.files').fetchone()
+    if low is None:
+        return None
+    return low, high
+
+def file_marks(db):
+    # The last file id and how many files there are, or None if files can't
+    # be told apart by id
+    if file_ids(db) is None:
+        return None
+    return tuple(connection(db).execute(
+        'SELECT max(id), count(*) FROM main.files').fetchone())
+
+def count_files(db, last):
+    return connection(db).execute(
+        'SELECT count(*) FROM main.files WHERE id <= ?', (last,)).fetchone()[0]
+
+class FileReads(object):
+    # Whether statements read files through the view restrict_files makes,
+    # and whether any read main.files directly around it
+    def __init__(self):
+        self.view = False
+        self.table = False
+
+    def authorize(self, action, table, column, database, source):
+        if action == sqlite3.SQLITE_READ and table == 'files':
+            if database == 'temp':
+                self.view = True
+            elif source is None:
+                self.table = True
+        return sqlite3.SQLITE_OK
+
+    @property
+    def restricted(self):
+        return self.view and not self.table
+
+def restrict_files(db, start, end):
+    # Unqualified names find temp objects first, so the monitor's own
+    # queries only see files with ids from start up to end, if they name the
+    # table that way.  The returned FileReads tells whether they did;
+    # setting an authorizer makes sqlite prepare cached statements again, so
+    # it sees every one.
+    conn = connection(db)
+    conn.execute('DROP VIEW IF EXISTS temp.files')
+    conn.execute(
+        'CREATE TEMP VIEW files AS SELECT * FROM main.files '
+        'WHERE id >= {} AND id < {}'.format(int(start), int(end)))
+    reads = FileReads()
+    conn.set_authorizer(reads.authorize)
+    return reads
+
+def unrestrict_files(db):
+    conn = connection(db)
+    conn.set_authorizer(None)
+    conn.execute('DROP VIEW IF EXISTS temp.files')
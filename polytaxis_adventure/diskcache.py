@@ -0,0 +1,244 @@
+import os
+import array
+import pickle
+import hashlib
+import threading
+import traceback
+import collections
+import concurrent.futures
+
+from .table import strings, directories, no_path, Table, Row
+
+version = 2
+
+def _dump(path, data):
+    temp = path + '.tmp'
+    with open(temp, 'wb') as out:
+        pickle.dump(data, out, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+
+def _load(path):
+    with open(path, 'rb') as source:
+        data = pickle.load(source)
+    if data.get('version') != version:
+        return None
+    return data
+
+def pack(rows):
+    # Tables with their own string list, since interned ids only mean
+    # something within one session
+    numbers = {}
+    tables = []
+    row_tables = array.array('I')
+    row_indexes = array.array('I')
+    for row in rows:
+        number = numbers.get(row.table)
+        if number is None:
+            number = numbers[row.table] = len(tables)
+            tables.append(row.table)
+        row_tables.append(number)
+        row_indexes.append(row.index)
+    def localize(columns, values):
+        ids = sorted({
+            id for column in columns for id in set(column) if id != no_path})
+        local = {id: index for index, id in enumerate(ids)}
+        local[no_path] = no_path
+        return [values[id] for id in ids], local.__getitem__
+    local_strings, local_get = localize(
+        [column for table in tables for column in (table.keys, table.values)],
+        strings.values,
+    )
+    local_directories, local_directory = localize(
+        [table.directories for table in tables], directories.values)
+    return {
+        'strings': local_strings,
+        'directories': local_directories,
+        'tables': [
+            (
+                table.starts, 
+                array.array('I', map(local_get, table.keys)),
+                array.array('I', map(local_get, table.values)),
+                array.array('I', map(local_directory, table.directories)),
+                array.array('I', map(local_get, table.filenames)),
+            )
+            for table in tables
+        ],
+        'row_tables': row_tables,
+        'row_indexes': row_indexes,
+    }
+
+def unpack(packed):
+    def remap(interned, values):
+        remap = {
+            local: interned.id(value) for local, value in enumerate(values)}
+        remap[no_path] = no_path
+        return remap.__getitem__
+    remap_get = remap(strings, packed['strings'])
+    remap_directory = remap(directories, packed['directories'])
+    tables = []
+    for starts, keys, values, row_directories, filenames in packed['tables']:
+        table = Table()
+        table.starts = starts
+        table.keys = array.array('I', map(remap_get, keys))
+        table.values = array.array('I', map(remap_get, values))
+        table.directories = array.array(
+            'I', map(remap_directory, row_directories))
+        table.filenames = array.array('I', map(remap_get, filenames))
+        tables.append(table)
+    return [
+        Row(tables[number], index) 
+        for number, index in zip(packed['row_tables'], packed['row_indexes'])
+    ]
+
+def unpack_tags(packed):
+    # Plain tag dicts, as the monitor's queries give them, without interning
+    # anything
+    local_strings = packed['strings']
+    local_directories = packed['directories']
+    tables = packed['tables']
+    for number, index in zip(packed['row_tables'], packed['row_indexes']):
+        starts, keys, values, row_directories, filenames = tables[number]
+        tags = {}
+        for pair in range(starts[index], starts[index + 1]):
+            tags.setdefault(
+                local_strings[keys[pair]], set()
+            ).add(local_strings[values[pair]])
+        directory = row_directories[index]
+        if directory != no_path:
+            tags['path'] = {
+                local_directories[directory] + 
+                local_strings[filenames[index]]
+            }
+        yield {'tags': tags}
+
+class DiskCache(object):
+    # Completion tags and frequencies, column names and recent results kept
+    # between sessions.  Everything is stamped with the database state it
+    # came from and ignored once that changes.  Results are written on a
+    # thread of their own, since packing and pickling them takes a while.
+    def __init__(self, directory, max_results=16, max_rows=50000):
+        self.directory = directory
+        self.max_results = max_results
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.writer = None
+        self.path = None
+        self.stamp = None
+        self.tags = None
+        self.frequencies = {}
+        self.columns = []
+        self.results = collections.OrderedDict()
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self, stamp):
+        # stamp(path) for the database path the cache was saved with; True if
+        # the saved index is still valid
+        try:
+            data = _load(self._file('index.pickle'))
+        except FileNotFoundError:
+            return False
+        except:
+            print('Failed to load cache index:\n{}'.format(
+                traceback.format_exc()))
+            return False
+        if data is None:
+            return False
+        self.path = data['path']
+        if stamp(self.path) != data['stamp']:
+            for key in data['results']:
+                self._remove(key)
+            return False
+        self.stamp = data['stamp']
+        self.tags = data['tags']
+        self.frequencies = data['frequencies']
+        self.columns = data['columns']
+        self.results = data['results']
+        return True
+
+    def save(self, path, index, columns):
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)
+            self.writer = None
+        if path is None or index is None or index.stamp is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with self.lock:
+                results = collections.OrderedDict(self.results)
+            _dump(self._file('index.pickle'), {
+                'version': version,
+                'path': path,
+                'stamp': index.stamp,
+                'tags': index.tags,
+                'frequencies': index.frequencies,
+                'columns': list(columns),
+                'results': results,
+            })
+        except:
+            print('Failed to save cache index:\n{}'.format(
+                traceback.format_exc()))
+
+    def _result_name(self, key):
+        includes, excludes = key
+        return 'result-{}.pickle'.format(hashlib.md5(repr((
+            sorted(includes), sorted(excludes))).encode('utf-8')).hexdigest())
+
+    def _remove(self, key):
+        try:
+            os.remove(self._file(self._result_name(key)))
+        except OSError:
+            pass
+
+    def get(self, includes, excludes, stamp):
+        key = (frozenset(includes), frozenset(excludes))
+        with self.lock:
+            entry = self.results.get(key)
+        if entry is None:
+            return None
+        data = None
+        if entry == stamp:
+            try:
+                data = _load(self._file(self._result_name(key)))
+            except:
+                pass
+        with self.lock:
+            if self.results.get(key) != entry:
+                # Rewritten meanwhile
+                return None
+            if data is None or data['stamp'] != stamp:
+                del self.results[key]
+                self._remove(key)
+                return None
+            self.results.move_to_end(key)
+        return unpack(data['rows'])
+
+    def put(self, includes, excludes, stamp, rows):
+        # rows mustn't change after this
+        if stamp is None or len(rows) > self.max_rows:
+            return
+        if self.writer is None:
+            self.writer = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='cache')
+        key = (frozenset(includes), frozenset(excludes))
+        self.writer.submit(self._put, key, stamp, rows)
+
+    def _put(self, key, stamp, rows):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _dump(self._file(self._result_name(key)), {
+                'version': version,
+                'stamp': stamp,
+                'rows': pack(rows),
+            })
+        except:
+            print('Failed to save cached result:\n{}'.format(
+                traceback.format_exc()))
+            return
+        with self.lock:
+            self.results.pop(key, None)
+            self.results[key] = stamp
+            while len(self.results) > self.max_results:
+                key, old = self.results.popitem(last=False)
+                self._remove(key)
@@ -0,0 +1,112 @@
+import threading
+import traceback
+import concurrent.futures
+
+from .database import set_interrupt, is_interrupt
+
+class Cancelled(Exception):
+    pass
+
+class Token(object):
+    def __init__(self, executor, unique, background=False):
+        self.executor = executor
+        self.unique = unique
+        self.cancelled = False
+        self.background = background
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def yield_(self):
+        self.executor._wait_idle(self)
+        self.check()
+
+class QueryExecutor(object):
+    def __init__(self, connect, threads=4):
+        self.connect = connect
+        self.local = threading.local()
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix='query',
+        )
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.idle = threading.Condition()
+        self.foreground = 0
+
+    def db(self):
+        # One connection per pool thread, opened on first use
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.connect()
+        return db
+
+    def submit(self, channel, unique, job, background=False, done=None):
+        # done is called once the job is over, however it ended
+        token = Token(self, unique, background)
+        with self.lock:
+            old = self.tokens.get(channel)
+            self.tokens[channel] = token
+        if old:
+            old.cancel()
+        self.pool.submit(self._run, token, job, done)
+        return token
+
+    def cancel(self, channel):
+        with self.lock:
+            token = self.tokens.pop(channel, None)
+        if token:
+            token.cancel()
+
+    def shutdown(self):
+        with self.lock:
+            tokens = list(self.tokens.values())
+            self.tokens.clear()
+        for token in tokens:
+            token.cancel()
+        self.pool.shutdown(wait=False)
+
+    def _enter(self, token):
+        if token.background:
+            return
+        with self.idle:
+            self.foreground += 1
+
+    def _leave(self, token):
+        if token.background:
+            return
+        with self.idle:
+            self.foreground -= 1
+            self.idle.notify_all()
+
+    def _wait_idle(self, token):
+        with self.idle:
+            while self.foreground and not token.cancelled:
+                self.idle.wait(0.5)
+
+    def _run(self, token, job, done):
+        try:
+            if not token.cancelled:
+                self._run_job(token, job)
+        finally:
+            if done is not None:
+                done()
+
+    def _run_job(self, token, job):
+        db = self.db()
+        set_interrupt(db, lambda: token.cancelled)
+        self._enter(token)
+        try:
+            job(db, token)
+        except Cancelled:
+            pass
+        except Exception as error:
+            if not (token.cancelled and is_interrupt(error)):
+                traceback.print_exc()
+        finally:
+            self._leave(token)
+            set_interrupt(db, None)
@@ -0,0 +1,24 @@
+# The monitor has no change feed of its own, so changes are found by
+# watching the database stamp and diffing fresh results against the old ones
+
+def diff(old, new, partial=False):
+    # Rows to add and remove to turn old into new, matched by path.  Files
+    # whose tags changed are replaced.  If new is partial, files missing from
+    # it are left alone rather than removed.
+    by_path = {row.path_ids: row for row in old}
+    added = []
+    removed = []
+    for row in new:
+        existing = by_path.pop(row.path_ids, None)
+        if existing is None:
+            added.append(row)
+        elif existing.pairs() != row.pairs():
+            added.append(row)
+            removed.append(existing)
+    if not partial:
+        removed.extend(by_path.values())
+    return added, removed
+
+def diff_tags(old, new):
+    new = set(new)
+    return new - old, old - new
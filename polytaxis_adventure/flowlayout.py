@@ -64,6 +64,22 @@ class Window(QWidget):
 
 class FlowLayout(QLayout):
     def __init__(self, parent=None, margin=0, spacing=-1):
+        self.itemList = []
+        # Per item (sizeHint, minimumSize, spaceX, spaceY), None until
+        # measured
+        self.hintList = []
+        # Per item, the geometry it was last given
+        self.geometryList = []
+        # Qt invalidated the layout, so some item's hints may have changed.
+        # Qt doesn't say which, but widget items cache their hints, so
+        # comparing them against these is cheap.
+        self.stale = True
+        self.spacingUsed = None
+        # (x, y, right) -> (geometries, positions), positions[n] being the
+        # (x, y, lineHeight) after placing item n.  Changes drop both from
+        # the first changed item on and only the rest are placed again.
+        self.layouts = {}
+
         super(FlowLayout, self).__init__(parent)
 
         if parent is not None:
@@ -71,8 +87,6 @@ class FlowLayout(QLayout):
 
         self.setSpacing(spacing)
 
-        self.itemList = []
-
     def __del__(self):
         item = self.takeAt(0)
         while item:
@@ -80,6 +94,8 @@ class FlowLayout(QLayout):
 
     def addItem(self, item):
         self.itemList.append(item)
+        self.hintList.append(None)
+        self.geometryList.append(None)
 
     def count(self):
         return len(self.itemList)
@@ -93,11 +109,24 @@ class FlowLayout(QLayout):
     def takeAt(self, index):
         if index >= 0 and index < len(self.itemList):
             item = self.itemList.pop(index)
+            self.hintList.pop(index)
+            self.geometryList.pop(index)
+            self.changed(index)
             item.widget().hide()
             return item
 
         return None
 
+    def changed(self, index):
+        # Items from index on moved or changed size
+        for geometries, positions in self.layouts.values():
+            del geometries[index:]
+            del positions[index:]
+
+    def invalidate(self):
+        self.stale = True
+        super(FlowLayout, self).invalidate()
+
     def expandingDirections(self):
         return Qt.Orientations(Qt.Orientation(0))
 
@@ -116,45 +145,129 @@ class FlowLayout(QLayout):
         return self.minimumSize()
 
     def minimumSize(self):
+        self.measure()
         size = QSize()
 
-        for item in self.itemList:
-            size = size.expandedTo(item.minimumSize())
+        for hint in self.hintList:
+            size = size.expandedTo(hint[1])
 
         margin, _, _, _ = self.getContentsMargins()
 
         size += QSize(2 * margin, 2 * margin)
         return size
 
-    def doLayout(self, rect, testOnly):
-        x = rect.x()
-        y = rect.y()
-        lineHeight = 0
-
-        for item in self.itemList:
-            wid = item.widget()
-            spaceX = self.spacing() + wid.style().layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Horizontal)
-            spaceY = self.spacing() + wid.style().layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical)
-            nextX = x + item.sizeHint().width() + spaceX
-            if nextX - spaceX > rect.right() and lineHeight > 0:
-                x = rect.x()
-                y = y + lineHeight + spaceY
-                nextX = x + item.sizeHint().width() + spaceX
-                lineHeight = 0
-
-            if not testOnly:
-                item.setGeometry(QRect(QPoint(x, y), item.sizeHint()))
+    def measure(self):
+        check = self.stale
+        self.stale = False
+        spacing = self.spacing()
+        if spacing != self.spacingUsed:
+            self.spacingUsed = spacing
+            self.hintList = [None] * len(self.itemList)
+        first = None
+        for index, item in enumerate(self.itemList):
+            old = self.hintList[index]
+            if old is not None and not check:
+                continue
+            hint = item.sizeHint()
+            minimum = item.minimumSize()
+            if old is not None and old[0] == hint and old[1] == minimum:
+                continue
+            style = item.widget().style()
+            self.hintList[index] = (
+                hint,
+                minimum,
+                spacing + style.layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Horizontal),
+                spacing + style.layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical),
+            )
+            if first is None:
+                first = index
+        if first is not None:
+            self.changed(first)
 
-            x = nextX
-            lineHeight = max(lineHeight, item.sizeHint().height())
-
-        return y + lineHeight - rect.y()
+    def doLayout(self, rect, testOnly):
+        self.measure()
+        key = (rect.x(), rect.y(), rect.right())
+        layout = self.layouts.get(key)
+        if layout is None:
+            if len(self.layouts) > 32:
+                self.layouts.clear()
+            layout = self.layouts[key] = ([], [])
+        geometries, positions = layout
+
+        if len(geometries) < len(self.hintList):
+            if positions:
+                x, y, lineHeight = positions[-1]
+            else:
+                x, y, lineHeight = rect.x(), rect.y(), 0
+
+            for hint, minimum, spaceX, spaceY in self.hintList[len(geometries):]:
+                nextX = x + hint.width() + spaceX
+                if nextX - spaceX > rect.right() and lineHeight > 0:
+                    x = rect.x()
+                    y = y + lineHeight + spaceY
+                    nextX = x + hint.width() + spaceX
+                    lineHeight = 0
+
+                geometries.append(QRect(QPoint(x, y), hint))
+
+                x = nextX
+                lineHeight = max(lineHeight, hint.height())
+                positions.append((x, y, lineHeight))
+
+        if not testOnly:
+            # Only items that moved or resized are touched
+            for index, geometry in enumerate(geometries):
+                if self.geometryList[index] != geometry:
+                    self.itemList[index].setGeometry(geometry)
+                    self.geometryList[index] = geometry
+
+        if not positions:
+            return 0
+        return positions[-1][1] + positions[-1][2] - rect.y()
 
     def insertWidget(self, index, widget):
         # added per http://stackoverflow.com/questions/17785729/how-to-add-an-item-to-the-specific-index-in-the-layout
         self.addWidget(widget)
-        self.itemList.insert(index, self.itemList.pop(len(self.itemList) - 1))
-
+        for items in (self.itemList, self.hintList, self.geometryList):
+            items.insert(index, items.pop(len(items) - 1))
+        self.changed(index)
+
+    def insertWidgets(self, widgets):
+        # (index, widget) pairs, by index in the resulting order, added with
+        # one relayout from the first index on
+        widgets = sorted(widgets, key=lambda pair: pair[0])
+        if not widgets:
+            return
+        for index, widget in widgets:
+            # Added through addWidget for the item type that caches hints
+            self.addWidget(widget)
+            for items in (self.itemList, self.hintList, self.geometryList):
+                items.insert(index, items.pop(len(items) - 1))
+        self.changed(widgets[0][0])
+        super(FlowLayout, self).invalidate()
+
+    def removeWidgets(self, widgets):
+        # Like removeWidget for each, but without looking each one up through
+        # itemAt
+        widgets = set(widgets)
+        keep = []
+        first = None
+        for index, (item, hint, geometry) in enumerate(zip(
+                self.itemList, self.hintList, self.geometryList)):
+            if item.widget() in widgets:
+                if first is None:
+                    first = index
+            else:
+                keep.append((item, hint, geometry))
+        if first is None:
+            return
+        self.itemList = [item for item, hint, geometry in keep]
+        self.hintList = [hint for item, hint, geometry in keep]
+        self.geometryList = [geometry for item, hint, geometry in keep]
+        self.changed(first)
+        for widget in widgets:
+            widget.hide()
+        super(FlowLayout, self).invalidate()
 
 if __name__ == '__main__':
 
@@ -0,0 +1,351 @@
+import os
+import time
+import threading
+from collections import defaultdict
+
+class LauncherMatcher(object):
+    # Launcher keys are filename suffixes starting at a dot.  They're stored
+    # reversed in a trie so one walk back from the end of a filename finds
+    # every key that applies.
+    def __init__(self, keyed):
+        self.trie = {}
+        for key in keyed:
+            if not key.startswith('.'):
+                continue
+            node = self.trie
+            for char in reversed(key):
+                node = node.setdefault(char, {})
+            node[None] = key
+        # Each distinct combination of matched keys gets a bunch id, 0 being
+        # no match, so rows can be counted with a single id
+        self.ids = {(): 0}
+        self.bunches = [()]
+        # Filenames repeat across rows and queries
+        self.matches = {}
+
+    def match(self, filename):
+        id = self.matches.get(filename)
+        if id is not None:
+            return id
+        node = self.trie
+        keys = []
+        for char in reversed(filename):
+            node = node.get(char)
+            if node is None:
+                break
+            key = node.get(None)
+            if key is not None:
+                keys.append(key)
+        keys = tuple(keys)
+        id = self.ids.get(keys)
+        if id is None:
+            id = self.ids[keys] = len(self.bunches)
+            self.bunches.append(keys)
+        self.matches[filename] = id
+        return id
+
+    def key_counts(self, counts):
+        out = defaultdict(int)
+        for id, count in counts.items():
+            if not count:
+                continue
+            for key in self.bunches[id]:
+                out[key] += count
+        return out
+
+class LaunchCounts(object):
+    def __init__(self):
+        self.matcher = LauncherMatcher({})
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.counts = defaultdict(int)
+
+    def set_matcher(self, matcher):
+        rows = list(self.ids)
+        self.matcher = matcher
+        self.clear()
+        self.add(rows)
+
+    def remove(self, rows):
+        for row in rows:
+            id = self.ids.pop(row, None)
+            if id is not None:
+                self.counts[id] -= 1
+
+    def add(self, rows):
+        match = self.matcher.match
+        for row in rows:
+            id = match(row.filename)
+            self.ids[row] = id
+            self.counts[id] += 1
+
+one_file = '{one-file}'
+all_files = '{all-files}'
+
+def _arg_size(arg):
+    # The string, its terminator and its pointer in argv
+    return len(os.fsencode(arg)) + 1 + 8
+
+def arg_limit():
+    # Bytes of arguments a command can take, like xargs works out
+    try:
+        limit = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        limit = -1
+    if limit <= 0:
+        # Windows' command line limit
+        limit = 32767
+    environment = sum(
+        _arg_size('{}={}'.format(key, value))
+        for key, value in os.environ.items()
+    )
+    return max(4096, limit - environment - 2048)
+
+def chunk_args(command, paths, limit=None):
+    # Expands {all-files} into as few commands as fit in the argument limit
+    if limit is None:
+        limit = arg_limit()
+    repeats = command.count(all_files)
+    fixed = sum(_arg_size(arg) for arg in command if arg != all_files)
+
+    def expand(chunk):
+        args = []
+        for arg in command:
+            if arg == all_files:
+                args.extend(chunk)
+            else:
+                args.append(arg)
+        return args
+
+    out = []
+    chunk = []
+    size = fixed
+    for path in paths:
+        path_size = _arg_size(path) * repeats
+        if chunk and size + path_size > limit:
+            out.append(expand(chunk))
+            chunk = []
+            size = fixed
+        chunk.append(path)
+        size += path_size
+    if chunk:
+        out.append(expand(chunk))
+    return out
+
+class Command(object):
+    # With `input`, the command reads it from stdin, or with `to_file` from a
+    # temporary file whose path replaces {all-files}.  The file is removed
+    # when the command exits.
+    def __init__(self, args, input=None, to_file=False):
+        self.args = args
+        self.input = input
+        self.to_file = to_file
+        self.temp = None
+
+    def prepare(self):
+        if not self.to_file:
+            return self.args
+        import tempfile
+        fd, self.temp = tempfile.mkstemp(
+            prefix='polytaxis-adventure-', suffix='.txt')
+        with open(fd, 'wb') as temp:
+            temp.write(self.input)
+        return [self.temp if arg == all_files else arg for arg in self.args]
+
+    def cleanup(self):
+        if self.temp is None:
+            return
+        try:
+            os.remove(self.temp)
+        except OSError:
+            pass
+        self.temp = None
+
+def _describe(args):
+    if len(args) > 8:
+        return '{} ... ({} arguments)'.format(args[:8], len(args))
+    return str(args)
+
+def _feed(output, input):
+    # From its own thread, a command that's slow to read (or never does)
+    # doesn't hold up the launch
+    try:
+        with output:
+            output.write(input)
+    except OSError:
+        pass
+
+if hasattr(os, 'posix_spawnp'):
+    import signal
+
+    # Spawning without forking the whole interpreter, with nothing connected
+    _spawn_actions = [
+        (os.POSIX_SPAWN_OPEN, fd, os.devnull, flags, 0)
+        for fd, flags in [
+            (0, os.O_RDONLY), (1, os.O_WRONLY), (2, os.O_WRONLY)]
+    ]
+    # Python ignores these but commands expect the defaults
+    _spawn_signals = [
+        getattr(signal, name) 
+        for name in ['SIGPIPE', 'SIGXFSZ'] 
+        if hasattr(signal, name)
+    ]
+
+    def _spawn(args, input):
+        if input is None:
+            return os.posix_spawnp(
+                args[0], args, os.environ, 
+                file_actions=_spawn_actions,
+                setsigdef=_spawn_signals,
+            )
+        read, write = os.pipe()
+        try:
+            pid = os.posix_spawnp(
+                args[0], args, os.environ, 
+                file_actions=[(os.POSIX_SPAWN_DUP2, read, 0)] + _spawn_actions[1:],
+                setsigdef=_spawn_signals,
+            )
+        except:
+            os.close(write)
+            raise
+        finally:
+            os.close(read)
+        feed = threading.Thread(
+            target=_feed, args=(open(write, 'wb'), input), name='launch feed')
+        feed.daemon = True
+        feed.start()
+        return pid
+
+    def _poll(pid):
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if not done:
+            return None
+        if os.WIFEXITED(status):
+            return os.WEXITSTATUS(status)
+        return -os.WTERMSIG(status)
+else:
+    def _spawn(args, input):
+        import subprocess
+        process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if input is not None:
+            feed = threading.Thread(
+                target=_feed, args=(process.stdin, input), name='launch feed')
+            feed.daemon = True
+            feed.start()
+        return process
+
+    def _poll(process):
+        return process.poll()
+
+class LaunchJob(object):
+    # Runs a launcher's Commands from its own threads, spawning at most
+    # `concurrency` at once.  Children don't count against that once
+    # started, since some, like viewers, run until the user closes them.
+    # `notify(job)` is called from the job's thread as commands start and
+    # finish, at most every `interval` seconds and once when done.
+    def __init__(self, name, commands, concurrency, notify, interval=0.1):
+        self.name = name
+        self.commands = commands
+        self.concurrency = max(1, concurrency)
+        self.notify = notify
+        self.interval = interval
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+        self.cancelled = False
+        self.done = False
+        self.condition = threading.Condition()
+        self.last_notify = 0
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='launch')
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        # Commands already running are left alone
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def _changed(self, force=False):
+        now = time.perf_counter()
+        if force or now - self.last_notify >= self.interval:
+            self.last_notify = now
+            self.notify(self)
+
+    def _reap(self, running):
+        with self.condition:
+            children = list(running)
+        for child, command in children:
+            status = _poll(child)
+            if status is None:
+                continue
+            with self.condition:
+                running.remove((child, command))
+                self.finished += 1
+                if status != 0:
+                    self.failed += 1
+            command.cleanup()
+            if status != 0:
+                print('Launcher {} exited with status {}'.format(
+                    self.name, status))
+
+    def _spawn_all(self, commands, running):
+        # Each spawning thread takes the next command until they run out
+        while True:
+            with self.condition:
+                command = next(commands, None)
+                if self.cancelled or command is None:
+                    return
+                self.started += 1
+            try:
+                args = command.prepare()
+                print('spawning {}'.format(_describe(args)))
+                child = _spawn(args, None if command.to_file else command.input)
+            except (OSError, ValueError) as error:
+                command.cleanup()
+                with self.condition:
+                    self.finished += 1
+                    self.failed += 1
+                print('Failed to spawn {}: {}'.format(
+                    _describe(command.args), error))
+                continue
+            with self.condition:
+                running.append((child, command))
+                self.condition.notify_all()
+
+    def _run(self):
+        running = []
+        commands = iter(self.commands)
+        spawners = []
+        for index in range(min(self.concurrency, len(self.commands))):
+            thread = threading.Thread(
+                target=self._spawn_all, args=(commands, running), 
+                name='launch spawn')
+            thread.daemon = True
+            thread.start()
+            spawners.append(thread)
+        while any(thread.is_alive() for thread in spawners):
+            self._reap(running)
+            self._changed()
+            with self.condition:
+                self.condition.wait(0.05)
+        self._reap(running)
+        # Children can outlive the job, like viewers the user leaves open.
+        # They're still reaped but only failures are reported after this.
+        self.done = True
+        self._changed(True)
+        while running:
+            time.sleep(0.5)
+            failed = self.failed
+            self._reap(running)
+            if self.failed != failed:
+                self._changed(True)
@@ -1,13 +1,17 @@
+from . import startup
+
 import sys
 import os.path
-import subprocess
+import random
+import bisect
+import argparse
+import time
 from collections import defaultdict
 import traceback
 import json
 
 from PyQt5.QtCore import (
     QObject,
-    QThread,
     QTimer,
     QPoint,
     QRect,
@@ -20,12 +24,40 @@ from PyQt5.QtGui import (
     QPixmap,
 )
 import patricia
-import polytaxis_monitor.common as ptcommon
 import appdirs
 
 from .qtwrapper import *
 from .common import *
-from .settings import res
+from .settings import res, user_setting
+from .model import ResultModel
+from .store import ResultStore, sort_key
+from .executor import QueryExecutor
+from .completion import CompletionIndex
+from .cache import ResultCache
+from .table import compact
+from .database import (
+    path as database_path, 
+    stamp as database_stamp, 
+    watch_statements,
+    file_marks,
+    count_files,
+    restrict_files,
+    unrestrict_files,
+)
+from .launch import (
+    one_file,
+    all_files,
+    chunk_args,
+    Command,
+    LauncherMatcher,
+    LaunchCounts,
+    LaunchJob,
+)
+from .selection import Selection
+from .stream import BatchSizer, Stream
+from .diskcache import DiskCache
+from .feed import diff, diff_tags
+from . import trace
 
 # TODO
 # element types to vars
@@ -34,12 +66,26 @@ from .settings import res
 # tag editor
 # launcher editor
 
-one_file = '{one-file}'
-all_files = '{all-files}'
+display_page = 1000
+
+# How often to check whether the monitor changed the database, ms
+poll_interval = 2000
+
+# Refreshes between these only look for new files, ms
+full_refresh_interval = 30000
 
 icon_size = QSize(24, 24)
-icon_remove = None
-icons = {}
+
+# Decoded on first use rather than all at startup
+_pixmaps = {}
+def pixmap(name):
+    out = _pixmaps.get(name)
+    if out is None:
+        out = QPixmap(res('{}.png'.format(name)))
+        if not out:
+            raise RuntimeError('Unable to load icon {}'.format(name))
+        _pixmaps[name] = out
+    return out
 
 eltype_labels = {
     'inc': 'include',
@@ -55,16 +101,21 @@ known_columns = patricia.trie()
 elements = []
 drag_targets = []
 
-def to_gen(outer):
-    return outer()
-
 unwrap_root = os.path.join(
     appdirs.user_data_dir('polytaxis-unwrap', 'zarbosoft'),
     'mount',
 )
 
-def unwrap(path):
-    return os.path.join(unwrap_root, path[1:])
+_unwrapped = {}
+
+def unwrap(row):
+    # Joined once per directory
+    directory = row.directory
+    unwrapped = _unwrapped.get(directory)
+    if unwrapped is None:
+        unwrapped = _unwrapped[directory] = os.path.join(
+            unwrap_root, directory[1:])
+    return unwrapped + row.filename
 
 def collapse(callback):
     timer = QTimer()
@@ -108,11 +159,17 @@ class ElementButton(LayoutPushButton):
 
 class ElementBuilder(QObject):
     worker_result = pyqtSignal(int, list)
+    worker_stream = pyqtSignal(int, object)
+    index_result = pyqtSignal(object)
+    index_delta = pyqtSignal(object, object, list, list)
+    index_counts = pyqtSignal(object, dict)
 
     def __init__(self):
         super(ElementBuilder, self).__init__()
         self.element = None
         self.worker = None
+        self.index = None
+        self.sizer = BatchSizer()
 
         self.query_unique = 0
         self.text = None
@@ -145,16 +202,43 @@ class ElementBuilder(QObject):
             self.element.set_value(text)
             self.entry.setText(text)
 
-        @self.worker_result.connect
-        def handle_result(unique, values):
-            if unique != self.query_unique:
-                return
-            for row, value in enumerate(values):
+        def add(values):
+            for value in values:
                 self.results.addItem(value)
                 if value == self.text:
                     suppress_row_select[0] = True
-                    self.results.setCurrentRow(row)
+                    self.results.setCurrentRow(self.results.count() - 1)
                     suppress_row_select[0] = False
+
+        @self.worker_result.connect
+        def handle_result(unique, values):
+            if unique != self.query_unique:
+                return
+            add(values)
+
+        @self.worker_stream.connect
+        def handle_stream(unique, stream):
+            values = stream.take()
+            if unique != self.query_unique or not values:
+                return
+            start = time.perf_counter()
+            add(values)
+            self.sizer.measured(len(values), time.perf_counter() - start)
+
+        @self.index_result.connect
+        def handle_index(index):
+            self.index = index
+
+        @self.index_delta.connect
+        def handle_index_delta(index, stamp, added, removed):
+            if index is self.index:
+                index.change(added, removed)
+                index.stamp = stamp
+
+        @self.index_counts.connect
+        def handle_index_counts(index, counts):
+            if index is self.index:
+                index.update(counts)
     
     @collapse
     def _reset_query(self):
@@ -171,6 +255,15 @@ class ElementBuilder(QObject):
     def change_query(self):
         self.worker.build_query.emit(-1, '')
         self.results.clear()
+        if self.index is not None and self.element.type in ('inc', 'exc'):
+            self._reset_query.stop()
+            self.query_unique += 1
+            self.text = self.entry.text()
+            self.worker_result.emit(
+                self.query_unique, 
+                self.index.complete(self.element.last_query),
+            )
+            return
         self._reset_query()
 
     def set_element(self, element):
@@ -183,7 +276,7 @@ class ElementBuilder(QObject):
             self.worker.build_query.emit(-1, '')
             self.outer_widget.hide()
         else:
-            self.label.setPixmap(icons[element.type])
+            self.label.setPixmap(pixmap('icon_{}'.format(element.type)))
             self.entry.setText(element.value)
             self.change_query()
             self.outer_widget.show()
@@ -191,25 +284,62 @@ class ElementBuilder(QObject):
 
 class Display(QObject):
     worker_result = pyqtSignal(int, list)
+    worker_stream = pyqtSignal(int, object)
+    worker_delta = pyqtSignal(int, int, list, list, object)
+    worker_done = pyqtSignal(int, object)
+    worker_refreshed = pyqtSignal(int)
+    worker_path = pyqtSignal(str)
+    worker_tags = pyqtSignal()
+    launchers_loaded = pyqtSignal()
+    launch_progress = pyqtSignal(object)
     def __init__(self):
         super(Display, self).__init__()
         
         self.worker = None
+        self.build = None
 
         self.query_unique = 0
+        self.complete = False
+        self.revision = 0
+        # Rows read but not in the model yet, in the same order, and how
+        # many rows to show before holding them (0 for all)
+        self.held = ResultStore()
+        self.shown = display_page
+        # A refresh is running, and another is needed once it or the query
+        # finishes
+        self.refreshing = False
+        self.stale = False
+        # The database's file marks when the rows were last read in full or
+        # brought up to date, when the last full read started, and whether
+        # refreshes since only looked for new files
+        self.seen = None
+        self.full_read = 0
+        self.partial = False
         self.columns = None
         self.sort = None
         self.filters = None
         self.includes = None
         self.excludes = None
-        self.raw = []
+        self.db_path = None
+        self.cache = ResultCache()
+        self.disk_cache = None
+        self.sizer = BatchSizer()
 
         self.launchers = []
+        self.launches = []
+        self.launch_counts = LaunchCounts()
+        self.selection = Selection(self.launch_counts)
 
         context_menu = QMenu()
         open_menu = QMenu()
-        self.results = MouseLMRTreeWidget(tags=['display-tree'])
-        self.results.setSelectionMode(QTreeWidget.ExtendedSelection)
+        self.model = ResultModel()
+        self.results = MouseLMRTreeView(tags=['display-tree'])
+        self.results.setModel(self.model)
+        self.results.setRootIsDecorated(False)
+        self.results.setUniformRowHeights(True)
+        self.results.setAllColumnsShowFocus(True)
+        self.results.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.results.setSelectionBehavior(QAbstractItemView.SelectRows)
         @self.results.customContextMenuRequested.connect
         def callback(point):
             context_menu.exec(point)
@@ -218,88 +348,104 @@ class Display(QObject):
         tool_open = actions.addAction('Open')
         tool_open.setMenu(open_menu)
         tool_open.setEnabled(False)
+        self.load_all = actions.addAction('Load all')
+        self.load_all.setEnabled(False)
+        self.count = QLabel(tags=['display-count'])
+        actions.addWidget(self.count)
+        self.launch_status = QLabel(tags=['display-launch'])
+        actions.addWidget(self.launch_status)
+        self.cancel_launch = actions.addAction('Cancel launch')
+        self.cancel_launch.setVisible(False)
         layout = QVBoxLayout(tags=['display-layout'])
         layout.addWidget(self.results)
         layout.addWidget(actions)
         self.outer_widget = QFrame(tags=['display-widget'])
         self.outer_widget.setLayout(layout)
 
-        def spawn(command):
-            print('spawning {}'.format(command))
-            proc = subprocess.Popen(
-                command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            proc.stdin.close()
-            proc.stdout.close()
-            proc.stderr.close()
-
         def do_open(option):
-            print('callin open')
-            rows = [
-                self.raw[index.row()] 
-                for index in self.results.selectedIndexes()
-                if index.column() == 0
-            ]
-            if not rows:
-                rows = self.raw
+            rows = list(self.selection.rows) or self.model.rows
             if not rows:
                 return
-            paths = [
-                unwrap(path) if option.get('unwrap', True) else path
-                for path in [
-                    next(iter(row['tags']['path'])) 
-                    for row in rows
-                ]
-            ]
+            if option.get('unwrap', True):
+                paths = [unwrap(row) for row in rows]
+            else:
+                paths = [row.path for row in rows]
+            mode = option.get('paths', 'args')
             if one_file in option['command']:
-                for path in paths:
-                    spawn([
+                commands = [
+                    Command([
                         path if arg == one_file else arg
                         for arg in option['command']
                     ])
+                    for path in paths
+                ]
+            elif mode == 'stdin':
+                commands = [Command(
+                    [arg for arg in option['command'] if arg != all_files],
+                    input=''.join(path + '\n' for path in paths).encode(),
+                )]
             else:
                 if all_files not in option['command']:
                     raise RuntimeError('Option {} doesn\'t have any filepath arguments.'.format(option['name']))
-                args = []
-                for arg in option['command']:
-                    if arg == all_files:
-                        args.extend(paths)
-                    else:
-                        args.append(arg)
-                spawn(args)
-        
+                if mode == 'file':
+                    commands = [Command(
+                        option['command'],
+                        input=''.join(path + '\n' for path in paths).encode(),
+                        to_file=True,
+                    )]
+                elif mode == 'args':
+                    commands = [
+                        Command(args) 
+                        for args in chunk_args(option['command'], paths)
+                    ]
+                else:
+                    raise RuntimeError('Option {} has unknown paths mode {}.'.format(option['name'], mode))
+            job = LaunchJob(
+                option['name'],
+                commands,
+                user_setting('launch_concurrency', os.cpu_count() or 4),
+                self.launch_progress.emit,
+            )
+            self.launches.append(job)
+            self.cancel_launch.setVisible(True)
+            job.start()
+
+        @self.launch_progress.connect
+        def handle_launch_progress(job):
+            if job.done and job in self.launches:
+                self.launches.remove(job)
+            self.cancel_launch.setVisible(bool(self.launches))
+            if job.done:
+                text = '{} {}: {} of {}'.format(
+                    'Cancelled' if job.cancelled else 'Launched',
+                    job.name, job.started, len(job.commands))
+            else:
+                text = 'Launching {}: {} of {}'.format(
+                    job.name, job.started, len(job.commands))
+            if job.failed:
+                text = '{}, {} failed'.format(text, job.failed)
+            self.launch_status.setText(text)
+
+        @self.cancel_launch.triggered.connect
+        def handle_cancel_launch(checked):
+            for job in self.launches:
+                job.cancel()
+
         @collapse
         def update_launch_concensus():
-            launch_sums = defaultdict(lambda: {'count': 0, 'launcher': None})
-            rows = [
-                self.raw[index.row()] 
-                for index in self.results.selectedIndexes()
-            ]
-            if not rows:
-                rows = self.raw
-            for data in rows:
-                for key in data['tags']['launch_keys']:
-                    launcher_bunch = keyed_launchers.get(key)
-                    if launcher_bunch:
-                        launch_sum = launch_sums.get(id(launcher_bunch))
-                        if not launch_sum:
-                            launch_sum = {
-                                'count': 0,
-                                'launcher_bunch': launcher_bunch,
-                            }
-                            launch_sums[id(launcher_bunch)] = launch_sum
-                        launch_sum['count'] += 1
+            if self.selection:
+                counts = self.selection.counts
+            else:
+                counts = self.launch_counts.counts
+            key_counts = self.launch_counts.matcher.key_counts(counts)
             self.launchers = []
-            for top in sorted(launch_sums.items(), key=lambda x: x[1]['count']):
+            for key, count in sorted(
+                    key_counts.items(), key=lambda x: x[1], reverse=True):
                 if len(self.launchers) > 5:
                     break
-                launcher_bunch = top[1]['launcher_bunch']
-                if not launcher_bunch:
-                    continue
-                self.launchers.extend(launcher_bunch)
+                for launcher in keyed_launchers[key]:
+                    if launcher not in self.launchers:
+                        self.launchers.append(launcher)
             self.launchers.extend(
                 wildcard_launchers
             )
@@ -317,25 +463,187 @@ class Display(QObject):
                 tool_open.setText('Open with ' + self.launchers[0]['name'])
             tool_open.setEnabled(bool(self.launchers))
         
+        def insert(rows):
+            for table in {row.table for row in rows}:
+                for key in table.key_names():
+                    known_columns[key] = None
+            self.model.insert(rows)
+            self.launch_counts.add(rows)
+            self._resize_columns()
+            self._update_count()
+            update_launch_concensus()
+
+        def remove(rows):
+            self.selection.change((), rows)
+            self.launch_counts.remove(rows)
+            self.model.remove(rows)
+
+        def show(rows=()):
+            # The model has the first shown rows in sort order and the rest
+            # are held until scrolled to, so each page continues the last
+            held = self.held
+            store = self.model.store
+            # Cleared meanwhile, or the view fetches more as it relays out
+            self.model.more = False
+            for position, keys, run in held.plan(rows):
+                held.insert(position, keys, run)
+            if self.shown:
+                # Merge to find how many of each make the first shown rows,
+                # from the model rows sorting before every held one
+                kept = count = 0
+                if held.keys:
+                    kept = min(
+                        self.shown, 
+                        bisect.bisect_right(store.keys, held.keys[0]))
+                while kept + count < self.shown and count < len(held.keys):
+                    if (
+                            kept < len(store.keys) and 
+                            not held.keys[count] < store.keys[kept]):
+                        kept += 1
+                    else:
+                        count += 1
+                kept = self.shown - count
+            else:
+                kept = len(store.rows)
+                count = len(held.rows)
+            pushed = store.rows[kept:]
+            if pushed:
+                remove(pushed)
+                for position, keys, run in held.plan(pushed):
+                    held.insert(position, keys, run)
+            rows = held.rows[:count]
+            held.delete(0, count)
+            if rows:
+                insert(rows)
+            self.model.more = bool(held.rows)
+            self._update_count()
+            return rows
+
         @self.worker_result.connect
         def handle_result(unique, rows):
             if unique != self.query_unique:
                 return
-            for row in rows:
-                for key in row['tags'].keys():
-                    known_columns[key] = None
-            self.raw.extend(rows)
-            self._redisplay()
+            show(rows)
+
+        @self.worker_stream.connect
+        def handle_stream(unique, stream):
+            rows = stream.take()
+            if unique != self.query_unique or not rows:
+                return
+            start = time.perf_counter()
+            with trace.span('model update', 'gui', query=unique, rows=len(rows)):
+                rows = show(rows)
+            if not rows:
+                return
+            inserted = time.perf_counter()
+            # Lay out now rather than on the next pass so it's measured too
+            with trace.span('relayout', 'gui', query=unique):
+                self.results.executeDelayedItemsLayout()
+            self.sizer.measured(
+                len(rows), 
+                inserted - start, 
+                time.perf_counter() - inserted,
+            )
+
+        @self.worker_delta.connect
+        def handle_delta(unique, revision, added, removed, seen):
+            if unique != self.query_unique:
+                return
+            if revision != self.revision:
+                # The rows changed while the refresh ran
+                self.stale = True
+                return
+            self.revision += 1
+            self.seen = seen
+            if removed and self.held.rows:
+                held = set(self.held.rows)
+                for position in sorted(self.held.find(
+                        [row for row in removed if row in held]), reverse=True):
+                    self.held.delete(position, position + 1)
+                removed = [row for row in removed if row not in held]
+            remove(removed)
+            if self.shown and self.model.rows:
+                # Rows added among the shown ones don't push others out of
+                # view
+                last = self.model.store.keys[-1]
+                self.shown = max(self.shown, len(self.model.rows) + len([
+                    row for row in added 
+                    if sort_key(self.held.sort, self.held.seed, row) < last
+                ]))
+            show(added)
+            if not self.stale:
+                self._store()
+
+        @self.worker_refreshed.connect
+        def handle_refreshed(unique):
+            if unique != self.query_unique:
+                return
+            self.refreshing = False
+            if self.stale:
+                self._refresh()
+
+        @self.worker_done.connect
+        def handle_done(unique, seen):
+            if unique != self.query_unique:
+                return
+            self.seen = seen
+            trace.event(
+                'display finish', 'gui', query=unique, 
+                rows=len(self.model.rows) + len(self.held.rows))
+            self.complete = True
+            if self.stale:
+                # The database changed while the rows were read
+                self._refresh()
+            else:
+                self._store()
+
+        @self.launchers_loaded.connect
+        def handle_launchers_loaded():
+            self.launch_counts.set_matcher(LauncherMatcher(keyed_launchers))
+            self.selection.recount()
             update_launch_concensus()
 
+        @self.worker_path.connect
+        def handle_path(path):
+            self.db_path = path
+
+        @self.worker_tags.connect
+        def handle_tags():
+            # Rows may have come from the tag index before it caught up
+            self._refresh()
+
+        @self.model.more_requested.connect
+        def handle_more():
+            self.shown = len(self.model.rows) + display_page
+            show()
+
+        @self.load_all.triggered.connect
+        def handle_load_all(checked):
+            self.shown = 0
+            show()
+
         @self.results.m_clicked_anywhere.connect
         def handle_m_clicked():
             self.results.clearSelection()
         
-        @self.results.itemSelectionChanged.connect
-        def callback():
+        def selection_rows(selection):
+            rows = self.model.rows
+            for span in selection:
+                for row in range(span.top(), span.bottom() + 1):
+                    yield rows[row]
+
+        @self.results.selectionModel().selectionChanged.connect
+        def callback(selected, deselected):
+            self.selection.change(
+                selection_rows(selected), selection_rows(deselected))
+            self._update_count()
             update_launch_concensus()
 
+        @self.model.modelReset.connect
+        def callback():
+            # Resets drop the selection without selectionChanged
+            self.selection.clear()
+
         @self.results.r_clicked_anywhere.connect
         def handle_r_clicked(position):
             context_menu.exec(position)
@@ -352,76 +660,193 @@ class Display(QObject):
                 return
             do_open(self.launchers[0])
         
+        self.poll = QTimer()
+        self.poll.setInterval(poll_interval)
+        self.poll.timeout.connect(self._check_database)
+        self.poll.start()
+
     @collapse
     def _reset_query(self, unique):
+        trace.event('display submit', 'gui', query=unique)
         self.worker.display_query.emit(unique, self.includes, self.excludes)
+
+    def _clear(self):
+        seed = random.random()
+        self.model.clear(seed)
+        self.held.clear(seed)
+        self.launch_counts.clear()
+        self.complete = False
+        self.revision += 1
+        self.shown = display_page
+        self.refreshing = False
+        self.stale = False
+        self.seen = None
+        self.full_read = time.monotonic()
+        self.partial = False
+
+    def _rows(self):
+        return self.model.rows + self.held.rows
+
+    def _store(self):
+        rows = self._rows()
+        self.cache.put(self.includes, self.excludes, rows)
+        self.disk_cache.put(
+            self.includes, self.excludes, self.cache.stamp, rows)
+
+    def _check_database(self):
+        if self.db_path is None:
+            return
+        if not self.cache.validate(database_stamp(self.db_path)):
+            if (
+                    self.partial and 
+                    time.monotonic() - self.full_read > 
+                    full_refresh_interval / 1000):
+                self._refresh()
+            return
+        self.worker.build_index.emit()
+        self.worker.build_tags.emit()
+        self._refresh()
+
+    def _refresh(self):
+        if not (self.includes or self.excludes):
+            return
+        if self.refreshing or not self.complete:
+            # Rather than cancelling what's running, which under constant
+            # changes would never finish, refresh again once it's done
+            self.stale = True
+            return
+        self.stale = False
+        self.refreshing = True
+        seen = self.seen
+        if time.monotonic() - self.full_read > full_refresh_interval / 1000:
+            # New files are found without reading everything again, but
+            # changed tags on files already seen aren't, so those are caught
+            # by a full read now and then
+            seen = None
+        if seen is None:
+            self.full_read = time.monotonic()
+        self.partial = seen is not None
+        self.worker.refresh_query.emit(
+            self.query_unique, 
+            self.revision, 
+            self.includes, 
+            self.excludes, 
+            self._rows(),
+            seen,
+        )
     
-    def _redisplay(self):
-        self.raw = ptcommon.sort(self.sort, self.raw)
-        self.results.clear()
-        #self.results.setRowCount(0)
-        for row in self.raw:
-            self.results.addTopLevelItem(QTreeWidgetItem([
-                ', '.join(list(row['tags'].get(column, [])))
-                for column in self.columns]))
+    def _update_count(self):
+        self.load_all.setEnabled(self.model.more)
+        text = '{}{} rows'.format(
+            len(self.model.rows), '+' if self.model.more else '')
+        if self.selection:
+            text = '{}, {} selected'.format(text, len(self.selection))
+        self.count.setText(text)
+
+    def _resize_columns(self):
         self.results.header().resizeSections(QHeaderView.ResizeToContents)
 
     def change_query(self):
-        self.worker.display_query.emit(-1, set(), set())
-        cleared = [False]
-        def clear():
-            if not cleared[0]:
-                cleared[0] = True
-            self.results.clear()
-
-        includes = {
-            element.value for element in elements if element.type == 'inc'}
-        excludes = {
-            element.value for element in elements if element.type == 'exc'}
-        columns = []
-        sort = []
-        for element in elements:
-            if (
-                    element.type in ('col', 'sort_asc', 'sort_desc', 'sort_rand') 
-                    and element.value 
-                    and element.value not in columns
-                    ):
-                columns.append(element.value)
-            if element.type == 'sort_asc':
-                sort.append(('asc', element.value))
-            elif element.type == 'sort_desc':
-                sort.append(('desc', element.value))
-            elif element.type == 'sort_rand':
-                sort.append(('rand', element.value))
+        includes, excludes, columns, sort = parse_elements([
+            (element.type, element.value) for element in elements])
 
+        cached = None
         if includes != self.includes or excludes != self.excludes:
+            self.worker.display_query.emit(-1, set(), set())
             self.query_unique += 1
             known_columns = patricia.trie()
-            self.raw = []
             self.includes = includes
             self.excludes = excludes
-            clear()
+            self._clear()
+            self._update_count()
             if self.includes or self.excludes:
-                self._reset_query(self.query_unique)
+                if (
+                        self.db_path is not None and 
+                        self.cache.validate(database_stamp(self.db_path))):
+                    self.worker.build_index.emit()
+                    self.worker.build_tags.emit()
+                cached = self.cache.get(self.includes, self.excludes)
+                if cached is None and self.build.index is not None:
+                    cached = self.cache.refine(
+                        self.includes, self.excludes, self.build.index)
+                if cached is None and self.cache.stamp is not None:
+                    cached = self.disk_cache.get(
+                        self.includes, self.excludes, self.cache.stamp)
+                    if cached is not None:
+                        self.cache.put(self.includes, self.excludes, cached)
+                if cached is None:
+                    self._reset_query(self.query_unique)
+                else:
+                    self._reset_query.stop()
 
-        if columns != self.columns or sort != self.sort:
+        header = bool(columns)
+        if not columns:
+            columns = ['filename']
+            sort.append(('asc', 'filename'))
+        if columns != self.columns:
             self.columns = columns
+            self.results.header().setVisible(header)
+            self.model.set_columns(self.columns)
+            self._resize_columns()
+        if sort != self.sort:
             self.sort = sort
-            if self.columns:
-                self.results.setColumnCount(len(self.columns))
-                self.results.setHeaderLabels(self.columns)
-                self.results.header().show()
-            else:
-                self.results.header().hide()
-                self.results.setColumnCount(1)
-                self.columns = ['filename']
-                self.sort.append(('asc', 'filename'))
-            clear()
-            self._redisplay()
+            self.model.set_sort(self.sort)
+            self.held.set_sort(self.sort)
+            # Rows may move between the shown page and the held ones
+            self.worker_result.emit(self.query_unique, [])
+
+        if cached is not None:
+            # Already stored, so this skips handle_done
+            self.worker_result.emit(self.query_unique, cached)
+            self.complete = True
+
+class TracePanel(QObject):
+    def __init__(self):
+        super(TracePanel, self).__init__()
+        self.events = 0
+        self.plans = 0
+        self.results = QListWidget(tags=['trace-list'])
+        layout = QVBoxLayout(tags=['trace-layout'])
+        layout.addWidget(QLabel('Trace', tags=['trace-label']))
+        layout.addWidget(self.results)
+        self.outer_widget = QFrame(tags=['trace-widget'])
+        self.outer_widget.setLayout(layout)
+
+        self.timer = QTimer()
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self._update)
+        self.timer.start()
+
+    def _update(self):
+        events = trace.events[self.events:]
+        self.events += len(events)
+        for event in events:
+            args = dict(event['args'])
+            query = args.pop('query', None)
+            self.results.addItem('{:>10.1f} ms  {:>9}  {}{}{}'.format(
+                event.get('dur', 0) / 1000, 
+                event['cat'], 
+                '' if query is None else '#{} '.format(query),
+                event['name'], 
+                ''.join(
+                    '  {}={}'.format(key, value) 
+                    for key, value in sorted(args.items())
+                ),
+            ))
+        plans = list(trace.plans.values())[self.plans:]
+        self.plans += len(plans)
+        for plan in plans:
+            self.results.addItem('plan  {}\n    {}'.format(
+                plan['sql'], '\n    '.join(plan['plan'] or [])))
+        if events or plans:
+            while self.results.count() > 2000:
+                self.results.takeItem(0)
+            self.results.scrollToBottom()
 
 wildcard_launchers = []
 keyed_launchers = defaultdict(lambda: [])
-def main():
+def load_launchers():
+    start = time.perf_counter()
     launchers_path = os.path.join(
         appdirs.user_config_dir('polytaxis-adventure'),
         'launchers.json',
@@ -440,126 +865,320 @@ def main():
             launchers_path, 
             traceback.format_exc())
         )
+    startup.record('launchers', time.perf_counter() - start)
+
+def connect():
+    # polytaxis_monitor is only needed by the query threads, so it's imported
+    # there rather than before the window can show
+    start = time.perf_counter()
+    import polytaxis_monitor.common as ptcommon
+    db = ptcommon.QueryDB()
+    if trace.enabled:
+        watch_statements(db, trace.statement)
+    startup.record('database connect', time.perf_counter() - start)
+    return db
 
-    app = QApplication(sys.argv)
-
-    global icon_remove
-    icon_remove = QPixmap(res('icon_remove.png'))
-    global icons
-    icons = {
-        key: QPixmap(res('icon_{}.png'.format(key)))
-        for key in [
-            'exc',
-            'inc',
-            'col',
-            'sort_asc',
-            'sort_desc',
-            'sort_rand',
-        ]
-    }
-    icons['logo'] = QPixmap(res('logo.png'))
-    for icon in icons.values():
-        if not icon:
-            raise RuntimeError('Unable to load icon {}'.format(icon))
+def main():
+    startup.mark('imports')
+    parser = argparse.ArgumentParser(prog='polytaxis-adventure')
+    parser.add_argument('--profile-startup', action='store_true',
+        help='Print startup phase timings to stderr')
+    parser.add_argument('--trace', 
+        default=os.environ.get('PTADVENTURE_TRACE'),
+        help='Write query stage timings and plans here on exit')
+    parser.add_argument('--trace-format', choices=['chrome', 'json'],
+        default=os.environ.get('PTADVENTURE_TRACE_FORMAT', 'chrome'),
+        help='chrome (for chrome://tracing or Perfetto) or plain json')
+    parser.add_argument('--trace-panel', action='store_true',
+        default=bool(os.environ.get('PTADVENTURE_TRACE_PANEL')),
+        help='Show query stage timings in a panel')
+    args, qt_args = parser.parse_known_args()
+    startup.enabled = args.profile_startup
+    trace.configure(args.trace, args.trace_format, args.trace_panel)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    startup.mark('application')
 
     class Worker(QObject):
         build_query = pyqtSignal(int, str)
         display_query = pyqtSignal(int, set, set)
+        refresh_query = pyqtSignal(int, int, set, set, list, object)
+        build_index = pyqtSignal()
+        build_tags = pyqtSignal()
+        locate_db = pyqtSignal()
+        job_done = pyqtSignal(str)
+        tags_updated = pyqtSignal()
         def __init__(self):
             super(Worker, self).__init__()
 
             self.build = None
             self.display = None
 
-            self.current_build_query = None
-            self.current_display_query = None
-            self.db = ptcommon.QueryDB()
-            self.queue = []
-            self.idle = QTimer()
-            self.idle.setInterval(0)
-            @self.idle.timeout.connect
-            def idle():
-                if not self.queue:
-                    self.idle.stop()
+            self.executor = QueryExecutor(connect)
+            self.shards = None
+            processes = user_setting('query_processes', 0)
+            if processes > 1:
+                from .shard import ShardPool
+                self.shards = ShardPool(processes)
+
+            # Tag index for answering queries in memory, if enabled, and the
+            # database stamp it's being updated for
+            self.use_tags = user_setting('tag_index', False)
+            self.tags = None
+            self.tags_stamp = None
+
+            # Channels with a job running, and what to submit after it
+            self.waiting = {}
+
+            def serial(channel, submit):
+                # Jobs that would be cancelled by the next poll before they
+                # finish wait for the running one instead.  Only the latest
+                # waits; submit(done) gets the callback to submit with.
+                if channel in self.waiting:
+                    self.waiting[channel] = submit
                     return
-                work = self.queue.pop()
-                try:
-                    next(work)
-                except StopIteration:
-                    return
-                self.queue.append(work)
-            self.idle.start()
+                self.waiting[channel] = None
+                submit(lambda: self.job_done.emit(channel))
+
+            @self.job_done.connect
+            def job_done_handler(channel):
+                submit = self.waiting.pop(channel)
+                if submit is not None:
+                    serial(channel, submit)
+
+            def query_rows(db, token, includes, excludes):
+                # Rows and how to compact them
+                tags = self.tags
+                if tags is not None:
+                    with trace.span('tag index query'):
+                        ids = tags.query(includes, excludes)
+                    if ids is not None:
+                        return tags.rows(ids), list
+                if self.shards:
+                    work = self.shards.rows(
+                        db, includes, excludes, token.check)
+                    if work is not None:
+                        # Compacted by the shard processes
+                        return work, list
+                from .pipeline import display_rows
+                return display_rows(db, includes, excludes), compact
 
             @self.build_query.connect
             def build_query_handler(unique, arg):
-                try:
-                    self.queue.remove(self.current_build_query)
-                except ValueError:
-                    pass
                 if unique == -1:
-                    self.current_build_query = None
+                    self.executor.cancel('build')
                     return
-                @to_gen
-                def work():
-                    count = 0
-                    work = self.db.query_tags('prefix', arg)
-                    while True:
-                        rows = list(limit(100, work))
+                def work(db, token):
+                    from .pipeline import build_rows
+                    start = trace.now()
+                    stream = Stream(
+                        unique, self.build.sizer, self.build.worker_stream)
+                    work = build_rows(db, arg)
+                    while stream.count < 1000:
+                        with trace.span('build fetch', query=unique):
+                            rows = list(limit(
+                                min(stream.size(), 1000 - stream.count), 
+                                work,
+                            ))
                         if not rows:
-                            raise StopIteration()
-                        count += len(rows)
-                        self.build.worker_result.emit(unique, rows)
-                        if count >= 1000:
                             break
-                        yield
-                self.queue.append(work)
-                self.current_build_query = work
-                self.idle.start()
+                        token.check()
+                        stream.put(rows)
+                    trace.complete(
+                        'build query', start, query=unique, rows=stream.count)
+                self.executor.submit('build', unique, work)
             
             @self.display_query.connect
             def display_query_handler(unique, includes, excludes):
-                try:
-                    self.queue.remove(self.current_display_query)
-                except ValueError:
-                    pass
                 if unique == -1:
-                    self.current_display_query = None
-                    self.db.clear_cache()
+                    self.executor.cancel('display')
+                    self.executor.cancel('refresh')
                     return
-                @to_gen
-                def work():
-                    count = 0
-                    work = self.db.query(
-                            includes, excludes,
-                        add_path=True)
+                def work(db, token):
+                    start = trace.now()
+                    db.clear_cache()
+                    seen = file_marks(db)
+                    stream = Stream(
+                        unique, self.display.sizer, self.display.worker_stream)
+                    work, pack = query_rows(db, token, includes, excludes)
+                    # Read to the end rather than a page at a time, since an
+                    # unfinished statement keeps a read transaction open and
+                    # the monitor can't write until it's done.  The display
+                    # holds rows past the page until they're scrolled to.
                     while True:
-                        rows = list(limit(100, work))
+                        with trace.span('display fetch', query=unique):
+                            rows = list(limit(stream.size(), work))
                         if not rows:
-                            raise StopIteration()
-                        count += len(rows)
-                        for row in rows:
-                            path = next(iter(row['tags']['path']))
-                            filename = ptcommon.split_abs_path(path)[-1]
-                            row['tags']['filename'] = {filename}
-                            filename_splits = filename.split('.')
-                            launch_keys = set()
-                            for index in range(1, len(filename_splits)):
-                                launch_keys.add(
-                                    '.' + '.'.join(filename_splits[index:]))
-                            row['tags']['launch_keys'] = launch_keys
-                        self.display.worker_result.emit(unique, rows)
-                        if count >= 1000:
                             break
-                        yield
-                self.queue.append(work)
-                self.current_display_query = work
-                self.idle.start()
-
-    worker_thread = QThread()
-    worker_thread.start()
+                        if not stream.count:
+                            trace.event('display first row', query=unique)
+                        with trace.span(
+                                'display compact', query=unique, rows=len(rows)):
+                            rows = pack(rows)
+                        token.check()
+                        stream.put(rows)
+                    trace.complete(
+                        'display query', start, query=unique, rows=stream.count)
+                    self.display.worker_done.emit(unique, seen)
+                self.executor.submit('display', unique, work)
+
+            @self.refresh_query.connect
+            def refresh_query_handler(
+                    unique, revision, includes, excludes, rows, seen):
+                def added_rows(db, marks):
+                    # Rows for files added since seen, or None if files
+                    # already seen were removed or the new ones can't be
+                    # read apart from them
+                    last, count = seen
+                    if count_files(db, last) != count:
+                        return None
+                    from .pipeline import display_rows
+                    # From the last file seen, in case it was replaced
+                    reads = restrict_files(db, last, marks[0] + 1)
+                    try:
+                        new = compact(display_rows(db, includes, excludes))
+                    finally:
+                        unrestrict_files(db)
+                    if new and not reads.restricted:
+                        return None
+                    return new
+                def work(db, token):
+                    start = trace.now()
+                    db.clear_cache()
+                    marks = file_marks(db)
+                    if seen is not None and marks is not None:
+                        new = added_rows(db, marks)
+                        if new is not None:
+                            trace.complete(
+                                'refresh added', start, 
+                                query=unique, rows=len(new))
+                            token.check()
+                            added, removed = diff(rows, new, partial=True)
+                            self.display.worker_delta.emit(
+                                unique, revision, added, removed, marks)
+                            return
+                        start = trace.now()
+                    work, pack = query_rows(db, token, includes, excludes)
+                    new = []
+                    while True:
+                        batch = pack(limit(display_page, work))
+                        if not batch:
+                            break
+                        token.check()
+                        new.extend(batch)
+                    trace.complete(
+                        'refresh query', start, query=unique, rows=len(new))
+                    with trace.span('refresh diff', query=unique):
+                        added, removed = diff(rows, new)
+                    self.display.worker_delta.emit(
+                        unique, revision, added, removed, marks)
+                self.executor.submit(
+                    'refresh', unique, work, 
+                    done=lambda: self.display.worker_refreshed.emit(unique))
+
+            @self.build_index.connect
+            def build_index_handler():
+                def submit(done):
+                    index = self.build.index
+                    if index is not None:
+                        known = set(index.tags)
+                        counted = set(index.frequencies)
+                    use_tags = self.use_tags
+                    def work(db, token):
+                        from .pipeline import build_rows, tag_count
+                        start = trace.now()
+                        stamp = database_stamp(database_path(db))
+                        if index is None:
+                            new_index = CompletionIndex(
+                                build_rows(db, ''), stamp)
+                            tags = list(new_index.tags)
+                            token.check()
+                            self.build.index_result.emit(new_index)
+                        else:
+                            # Update the current index in place, counting
+                            # only tags it hasn't counted yet
+                            new_index = index
+                            tags = list(build_rows(db, ''))
+                            added, removed = diff_tags(known, tags)
+                            token.check()
+                            self.build.index_delta.emit(
+                                index, stamp, sorted(added), sorted(removed))
+                            tags = [tag for tag in tags if tag not in counted]
+                        trace.complete('index tags', start)
+                        if use_tags:
+                            # Ranked by the tag index's posting lengths
+                            # instead, once it's built
+                            if self.tags is not None:
+                                self.build.index_counts.emit(
+                                    new_index, self.tags.counts())
+                            return
+                        start = trace.now()
+                        # Ranking fills in as tags are counted
+                        counts = {}
+                        for tag in tags:
+                            token.yield_()
+                            if self.waiting.get('index') is not None:
+                                # The next update counts what's left
+                                break
+                            counts[tag] = tag_count(db, tag)
+                            if len(counts) >= 100:
+                                self.build.index_counts.emit(
+                                    new_index, counts)
+                                counts = {}
+                        if counts:
+                            self.build.index_counts.emit(new_index, counts)
+                        trace.complete('index count', start, tags=len(tags))
+                    self.executor.submit(
+                        'index', 0, work, background=True, done=done)
+                serial('index', submit)
+
+            @self.build_tags.connect
+            def build_tags_handler():
+                if not self.use_tags:
+                    return
+                if self.display.db_path is not None:
+                    stamp = database_stamp(self.display.db_path)
+                    if stamp == self.tags_stamp:
+                        return
+                    self.tags_stamp = stamp
+                def submit(done):
+                    def work(db, token):
+                        from .pipeline import build_rows
+                        from .tagindex import TagIndex, update
+                        start = trace.now()
+                        # The first pass builds an index aside, later ones
+                        # update the one in use
+                        tags = self.tags
+                        if tags is None:
+                            tags = TagIndex()
+                        update(
+                            tags, db, list(build_rows(db, '')), token.yield_)
+                        token.check()
+                        self.tags = tags
+                        trace.complete(
+                            'tag index', start, 
+                            files=len(tags.ids), tags=len(tags.postings))
+                        self.tags_updated.emit()
+                    self.executor.submit(
+                        'tags', 0, work, background=True, done=done)
+                serial('tags', submit)
+
+            @self.tags_updated.connect
+            def tags_updated_handler():
+                if self.build.index is not None:
+                    self.build.index.update(self.tags.counts())
+                self.display.worker_tags.emit()
+
+            @self.locate_db.connect
+            def locate_db_handler():
+                def work(db, token):
+                    self.display.worker_path.emit(database_path(db))
+                self.executor.submit('path', 0, work)
 
     worker = Worker()
-    worker.moveToThread(worker_thread)
+    app.aboutToQuit.connect(worker.executor.shutdown)
+    if worker.shards:
+        app.aboutToQuit.connect(worker.shards.shutdown)
     
     # Query element specification
     build = ElementBuilder()
@@ -569,11 +1188,17 @@ def main():
     # Result display and interaction
     display = Display()
     display.worker = worker
+    display.build = build
     worker.display = display
 
+    worker.locate_db.emit()
+
+    disk_cache = DiskCache(appdirs.user_cache_dir('polytaxis-adventure'))
+    display.disk_cache = disk_cache
+
     # Query bar
     appicon = QToolButton(tags=['appicon'])
-    appicon.setIcon(QIcon(icons['logo']))
+    appicon.setIcon(QIcon(res('logo.png')))
     appicon.setIconSize(QSize(48, 48))
     appicon.setToolTip('Clear query')
     @appicon.clicked.connect
@@ -588,7 +1213,7 @@ def main():
     query_toolbar.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
     def create_query_element_action(eltype):
         ellabel = eltype_labels[eltype]
-        action = QAction(QIcon(icons[eltype]), ellabel, query_toolbar, tags=['query-tool', eltype])
+        action = QAction(QIcon(res('icon_{}.png'.format(eltype))), ellabel, query_toolbar, tags=['query-tool', eltype])
         query_toolbar.addAction(action)
         def create(ign1):
             class Element():
@@ -599,12 +1224,12 @@ def main():
                 def recreate_widgets(self):
                     layout = QHBoxLayout(tags=['element-layout', eltype])
                     icon = QLabel(tags=['element-icon', eltype])
-                    icon.setPixmap(icons[eltype])
+                    icon.setPixmap(pixmap('icon_{}'.format(eltype)))
                     layout.addWidget(icon)
                     self.text = QLabel(self.value, tags=['element-text', eltype])
                     layout.addWidget(self.text)
                     self.delete = QToolButton(tags=['element-remove', eltype])
-                    self.delete.setIcon(QIcon(icon_remove))
+                    self.delete.setIcon(QIcon(res('icon_remove.png')))
                     layout.addWidget(self.delete)
                     self.toggle = ElementButton(tags=['element-toggle', eltype])
                     self.toggle.setLayout(layout)
@@ -618,13 +1243,15 @@ def main():
                             self.deselect()
 
                     def clear_drag():
+                        query.removeWidgets(drag_targets)
                         for target in drag_targets:
-                            query.removeWidget(target)
+                            target.deleteLater()
                         del drag_targets[:]
 
                     @self.toggle.drag_start.connect
                     def callback():
                         sindex = elements.index(self)
+                        targets = []
                         for index in range(len(elements) + 1):
                             if index in (sindex, sindex + 1):
                                 continue
@@ -641,8 +1268,9 @@ def main():
                                 query.insertWidget(dindex + 1, self.toggle)
                                 if was_checked:
                                     self.select()
-                            query.insertWidget(index + len(drag_targets) + 1, target)
+                            targets.append((index + len(targets) + 1, target))
                             drag_targets.append(target)
+                        query.insertWidgets(targets)
                     
                     @self.toggle.drag_stop.connect
                     def callback():
@@ -709,14 +1337,53 @@ def main():
 
     total_layout = QVBoxLayout(tags=['window-layout'])
     total_layout.addLayout(total_query_layout)
-    total_layout.addWidget(bottom_splitter, 1)
+    if args.trace_panel:
+        trace_panel = TracePanel()
+        trace_splitter = QSplitter(Qt.Vertical, tags=['trace-splitter'])
+        trace_splitter.addWidget(bottom_splitter)
+        trace_splitter.addWidget(trace_panel.outer_widget)
+        total_layout.addWidget(trace_splitter, 1)
+    else:
+        total_layout.addWidget(bottom_splitter, 1)
 
     window = QFrame(tags=['window'])
     window.setObjectName('window')
     window.setLayout(total_layout)
+    startup.mark('widgets')
     window.show()
 
     build.outer_widget.hide()
+    startup.mark('show')
+
+    # Nothing needs launchers until results are selected
+    def callback():
+        load_launchers()
+        display.launchers_loaded.emit()
+
+        start = time.perf_counter()
+        if disk_cache.load(database_stamp):
+            display.db_path = disk_cache.path
+            display.cache.validate(disk_cache.stamp)
+            for column in disk_cache.columns:
+                known_columns[column] = None
+            index = CompletionIndex(disk_cache.tags, disk_cache.stamp)
+            index.frequencies.update(disk_cache.frequencies)
+            build.index = index
+        startup.record('disk cache', time.perf_counter() - start)
+        if (
+                build.index is None or 
+                len(build.index.frequencies) < len(build.index.tags)):
+            # Nothing saved, or ranking wasn't finished last session
+            worker.build_index.emit()
+        worker.build_tags.emit()
+    QTimer.singleShot(0, callback)
+
+    @app.aboutToQuit.connect
+    def callback():
+        disk_cache.save(
+            display.db_path, build.index, known_columns.iter(''))
+        trace.dump()
+    QTimer.singleShot(0, startup.report)
     
     sys.exit(app.exec_())
 
@@ -0,0 +1,138 @@
+import bisect
+
+from PyQt5.QtCore import (
+    QAbstractTableModel,
+    QModelIndex,
+    Qt,
+    pyqtSignal,
+)
+
+from .store import ResultStore
+from . import trace
+
+# Past this many separate runs in one batch, insert rows with a relayout
+max_runs = 8
+
+class ResultModel(QAbstractTableModel):
+    more_requested = pyqtSignal()
+
+    def __init__(self):
+        super(ResultModel, self).__init__()
+        self.store = ResultStore()
+        self.columns = []
+        self.more = False
+
+    @property
+    def rows(self):
+        return self.store.rows
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        return ', '.join(row.get(self.columns[index.column()]))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation != Qt.Horizontal or role != Qt.DisplayRole:
+            return None
+        if section >= len(self.columns):
+            return None
+        return self.columns[section]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.more:
+            return
+        # Set again by the display if rows are still held after this page
+        self.more = False
+        self.more_requested.emit()
+
+    def set_columns(self, columns):
+        self.beginResetModel()
+        self.columns = list(columns)
+        self.endResetModel()
+
+    def clear(self, seed=0):
+        self.beginResetModel()
+        self.store.clear(seed)
+        self.more = False
+        self.endResetModel()
+
+    def insert(self, rows):
+        with trace.span('sort', 'gui', rows=len(rows)):
+            runs = self.store.plan(rows)
+        if len(runs) <= max_runs:
+            for position, keys, run in runs:
+                self.beginInsertRows(
+                    QModelIndex(), position, position + len(run) - 1)
+                self.store.insert(position, keys, run)
+                self.endInsertRows()
+            return
+
+        # Views do a lot of work per insert signal, so scattered rows are
+        # appended in one go then moved into place with a single relayout
+        runs.reverse()
+        count = len(self.rows)
+        self.beginInsertRows(QModelIndex(), count, count + len(rows) - 1)
+        for position, keys, run in runs:
+            self.rows.extend(run)
+        self.endInsertRows()
+
+        self.layoutAboutToBeChanged.emit()
+        del self.rows[count:]
+        positions = []
+        # New rows before each run
+        offsets = [0]
+        for position, keys, run in runs:
+            positions.append(position)
+            offsets.append(offsets[-1] + len(run))
+        for position, keys, run in reversed(runs):
+            self.store.insert(position, keys, run)
+        def moved(row):
+            if row < count:
+                return row + offsets[bisect.bisect_right(positions, row)]
+            appended = row - count
+            return positions[bisect.bisect_right(offsets, appended) - 1] + appended
+        old = self.persistentIndexList()
+        self.changePersistentIndexList(old, [
+            self.index(moved(index.row()), index.column()) for index in old
+        ])
+        self.layoutChanged.emit()
+
+    def remove(self, rows):
+        positions = sorted(self.store.find(rows), reverse=True)
+        while positions:
+            end = positions.pop(0) + 1
+            start = end - 1
+            while positions and positions[0] == start - 1:
+                start = positions.pop(0)
+            self.beginRemoveRows(QModelIndex(), start, end - 1)
+            self.store.delete(start, end)
+            self.endRemoveRows()
+
+    def set_sort(self, sort):
+        # Selection follows the rows to their new positions
+        self.layoutAboutToBeChanged.emit()
+        old = self.persistentIndexList()
+        old_rows = [self.rows[index.row()] for index in old]
+        self.store.set_sort(sort)
+        positions = {id(row): index for index, row in enumerate(self.rows)}
+        self.changePersistentIndexList(old, [
+            self.index(positions[id(row)], index.column())
+            for row, index in zip(old_rows, old)
+        ])
+        self.layoutChanged.emit()
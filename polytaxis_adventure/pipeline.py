@@ -0,0 +1,17 @@
+from .table import split_path
+
+def enrich(row):
+    # Adds what compact derives from the path to a plain row
+    path = next(iter(row['tags']['path']))
+    row['tags']['filename'] = {split_path(path)[1]}
+    return row
+
+def display_rows(db, includes, excludes):
+    # compact splits the filename from the path
+    yield from db.query(includes, excludes, add_path=True)
+
+def build_rows(db, arg):
+    return db.query_tags('prefix', arg)
+
+def tag_count(db, tag):
+    return sum(1 for row in db.query({tag}, set()))
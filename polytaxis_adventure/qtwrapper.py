@@ -1,5 +1,5 @@
-import itertools
 import collections
+import collections.abc
 import hashlib
 
 from PyQt5.QtCore import (
@@ -31,8 +31,7 @@ from PyQt5.QtWidgets import (
     QMenu,
     QLineEdit as _QLineEdit,
     QListWidget as _QListWidget,
-    QTreeWidget,
-    QTreeWidgetItem,
+    QTreeView,
     QHeaderView,
     QAbstractItemView,
     QFrame as _QFrame,
@@ -46,10 +45,32 @@ from .flowlayout import FlowLayout as _FlowLayout
 from .common import *
 from .settings import style_settings
 
-def _tag_keys(tags):
-    for sublen in range(len(tags)):
-        for subset in itertools.combinations(tags, sublen + 1):
-            yield frozenset(subset)
+# Style keys that include each tag, so widgets only look at keys that can
+# match instead of every combination of their tags
+_style_index = None
+
+def _style_keys(tags):
+    global _style_index
+    if _style_index is None:
+        _style_index = collections.defaultdict(list)
+        for key in style_settings():
+            for tag in key:
+                _style_index[tag].append(key)
+    positions = {}
+    for position, tag in enumerate(tags):
+        positions.setdefault(tag, position)
+    keys = {
+        key 
+        for tag in positions 
+        for key in _style_index.get(tag, ())
+        if all(subtag in positions for subtag in key)
+    }
+    # Same order the keys used to be applied in: smaller keys first, then by
+    # the order of the tags
+    return sorted(
+        keys, 
+        key=lambda key: (len(key), sorted(positions[tag] for tag in key)),
+    )
 
 def trym(dest, method, *pargs, **kwargs):
     if hasattr(dest, method):
@@ -57,47 +78,64 @@ def trym(dest, method, *pargs, **kwargs):
 
 def rupdate(d, u):
     for k, v in u.items():
-        if isinstance(v, collections.Mapping):
+        if isinstance(v, collections.abc.Mapping):
             r = rupdate(d.get(k, {}), v)
             d[k] = r
         else:
             d[k] = u[k]
     return d
 
+_styles = {}
+
+def _resolve_style(cls, use_name, default_style, tags):
+    cache_key = (cls, use_name, tuple(tags))
+    resolved = _styles.get(cache_key)
+    if resolved is not None:
+        return resolved
+    style = {}
+    rupdate(style, {'styleSheet': default_style})
+    for style_key in _style_keys(tags):
+        substyle = dict(style_settings()[style_key])
+        rupdate(style, substyle)
+    stylesheet = style.pop('styleSheet', None)
+    if stylesheet:
+        selectors = []
+        for key, values in stylesheet.items():
+            key = key.split(',')
+            if not key:
+                key = ['']
+            selectors.append(
+                '{} {{ {} }}'.format(
+                    ', '.join([
+                        '{}{}'.format(
+                            use_name,
+                            subkey,
+                        ) for subkey in key
+                    ]),
+                    '; '.join([
+                        '{}: {}'.format(key, value) 
+                        for key, value in values.items()
+                    ])
+                )
+            )
+        stylesheet = ' '.join(selectors)
+    resolved = _styles[cache_key] = (stylesheet, style)
+    return resolved
+
 def stylable(cls):
     class new_cls(cls):
         def __init__(self, *pargs, **kwargs):
             tags = kwargs.pop('tags', [])
             cls.__init__(self, *pargs, **kwargs)
             tags.append(cls.__name__)
-            use_name = getattr(self, '_style_name', cls.__name__)
-            style = {}
-            rupdate(style, {'styleSheet': getattr(self, '_default_style', {})})
-            for key in limit(100, _tag_keys(tags)):
-                substyle = dict(style_settings.get(key, {}))
-                rupdate(style, substyle)
-            stylesheet = style.pop('styleSheet', None)
+            stylesheet, style = _resolve_style(
+                cls,
+                getattr(self, '_style_name', cls.__name__),
+                getattr(self, '_default_style', {}),
+                tags,
+            )
+            style = dict(style)
             if stylesheet:
-                selectors = []
-                for key, values in stylesheet.items():
-                    key = key.split(',')
-                    if not key:
-                        key = ['']
-                    selectors.append(
-                        '{} {{ {} }}'.format(
-                            ', '.join([
-                                '{}{}'.format(
-                                    use_name,
-                                    subkey,
-                                ) for subkey in key
-                            ]),
-                            '; '.join([
-                                '{}: {}'.format(key, value) 
-                                for key, value in values.items()
-                            ])
-                        )
-                    )
-                stylesheet = ' '.join(selectors)
                 if not hasattr(self, 'setStyleSheet'):
                     print('no setStyleSheet! {}'.format(cls.__name__))
                 else:
@@ -110,7 +148,7 @@ def stylable(cls):
     return new_cls
 
 @stylable
-class MouseLMRTreeWidget(QTreeWidget):
+class MouseLMRTreeView(QTreeView):
     l_clicked_anywhere = pyqtSignal(QPoint)
     m_clicked_anywhere = pyqtSignal(QPoint)
     r_clicked_anywhere = pyqtSignal(QPoint)
@@ -133,7 +171,7 @@ class MouseLMRTreeWidget(QTreeWidget):
             self.r_clicked_anywhere.emit(event.globalPos())
             done = True
         if not done:
-            QTreeWidget.mousePressEvent(self, event)
+            QTreeView.mousePressEvent(self, event)
 
     def mouseReleaseEvent(self, event):
         done = False
@@ -150,7 +188,7 @@ class MouseLMRTreeWidget(QTreeWidget):
                 self.receivers(self.r_clicked_anywhere) > 0):
             done = True
         if not done:
-            QTreeWidget.mouseReleaseEvent(self, event)
+            QTreeView.mouseReleaseEvent(self, event)
 
 @stylable
 class QVBoxLayout(_QVBoxLayout):
@@ -0,0 +1,33 @@
+from collections import defaultdict
+
+class Selection(object):
+    # Selected rows kept up to date from selection change deltas.  Rows are
+    # tracked by object, so inserts and resorts don't disturb them.
+    def __init__(self, launch_counts):
+        self.launch_counts = launch_counts
+        self.clear()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def clear(self):
+        self.rows = {}
+        self.counts = defaultdict(int)
+
+    def change(self, selected, deselected):
+        rows = self.rows
+        counts = self.counts
+        ids = self.launch_counts.ids
+        for row in deselected:
+            if row in rows:
+                del rows[row]
+                counts[ids.get(row, 0)] -= 1
+        for row in selected:
+            if row not in rows:
+                rows[row] = None
+                counts[ids.get(row, 0)] += 1
+
+    def recount(self):
+        rows = list(self.rows)
+        self.clear()
+        self.change(rows, ())
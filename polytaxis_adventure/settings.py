@@ -1,16 +1,43 @@
 import json
 import os
-import pkg_resources
 
-import appdirs
+_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
 def res(path):
-    return pkg_resources.resource_filename('polytaxis_adventure', 'data/' + path)
+    return os.path.join(_data, path)
 
-with open(res('style.json'), 'r') as style_file:
-    style_settings = json.load(style_file)
+_style_settings = None
 
-style_settings = {
-    frozenset(key.split(' ')): value
-    for key, value in style_settings.items()
-}
+def style_settings():
+    global _style_settings
+    if _style_settings is None:
+        with open(res('style.json'), 'r') as style_file:
+            _style_settings = {
+                frozenset(key.split(' ')): value
+                for key, value in json.load(style_file).items()
+            }
+    return _style_settings
+
+_user_settings = None
+
+def user_settings():
+    # Optional settings.json next to launchers.json
+    global _user_settings
+    if _user_settings is None:
+        import appdirs
+        path = os.path.join(
+            appdirs.user_config_dir('polytaxis-adventure'),
+            'settings.json',
+        )
+        _user_settings = {}
+        try:
+            with open(path, 'r') as settings_file:
+                _user_settings = json.load(settings_file)
+        except FileNotFoundError:
+            pass
+        except Exception as error:
+            print('Failed to load {}: {}'.format(path, error))
+    return _user_settings
+
+def user_setting(name, default):
+    return user_settings().get(name, default)
@@ -0,0 +1,137 @@
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+
+from .database import path, open_read_only, file_ids, restrict_files
+from .diskcache import pack, unpack
+
+# Display queries split by file id across processes, each with its own
+# read-only connection.  Ranges start small so the first rows come back
+# quickly and grow up to an even share for each process.
+
+first_range = 2048
+
+_db = None
+
+def _open(db_path):
+    global _db
+    import polytaxis_monitor.common as ptcommon
+    _db = ptcommon.QueryDB()
+    open_read_only(_db, db_path)
+
+def _query(includes, excludes, start, end):
+    from .pipeline import display_rows
+    from .table import compact
+    _db.clear_cache()
+    reads = restrict_files(_db, start, end)
+    rows = compact(display_rows(_db, includes, excludes))
+    return pack(rows), len(rows), reads.restricted
+
+class ShardPool(object):
+    def __init__(self, processes):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.pool = None
+        self.db_path = None
+        self.warned = False
+        # The monitor's queries were seen reading files around the range view
+        self.unrestricted = False
+
+    def rows(self, db, includes, excludes, check=None, unpack=unpack):
+        # Compacted rows in file id order, as a single query would return
+        # them, or None if the index can't be split.  check is called while
+        # waiting for a range and can raise to stop.  unpack turns each
+        # range's packed rows into rows.
+        ids = file_ids(db)
+        if ids is None:
+            if not self.warned:
+                print('The index can\'t be split by file id, ignoring query_processes')
+                self.warned = True
+            return None
+        with self.lock:
+            if self.pool is None or self.db_path != path(db):
+                self._shutdown()
+                self.db_path = path(db)
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_open,
+                    initargs=(self.db_path,),
+                )
+                self.unrestricted = False
+            if self.unrestricted:
+                return None
+            pool = self.pool
+        ranges = self._ranges(pool, ids, includes, excludes, check)
+        # Rows from a range are only trusted once one is seen reading files
+        # through the view.  Until then ranges can only be empty.
+        for packed, count, restricted in ranges:
+            if restricted:
+                break
+            if count:
+                ranges.close()
+                print('The index\'s queries don\'t read files through the range view, ignoring query_processes')
+                self.unrestricted = True
+                return None
+        else:
+            return iter(())
+        return self._rows(packed, ranges, unpack)
+
+    def _rows(self, packed, ranges, unpack):
+        yield from unpack(packed)
+        for packed, count, restricted in ranges:
+            if count and not restricted:
+                self.unrestricted = True
+                raise RuntimeError('A query range read files outside it')
+            yield from unpack(packed)
+
+    def _ranges(self, pool, ids, includes, excludes, check):
+        # (packed rows, row count, restricted) for each range in order.
+        # Ranges are only started as results are taken, at most one per
+        # process.
+        low, high = ids
+        largest = max(first_range, (high - low + 1) // (self.processes * 2))
+
+        def ranges():
+            start = low
+            size = first_range
+            while start <= high:
+                yield start, start + size
+                start += size
+                size = min(size * 2, largest)
+        ranges = ranges()
+
+        pending = collections.deque()
+        def submit():
+            for start, end in ranges:
+                pending.append(pool.submit(
+                    _query, includes, excludes, start, end))
+                return
+
+        try:
+            for process in range(self.processes):
+                submit()
+            while pending:
+                while True:
+                    try:
+                        result = pending[0].result(0.1)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        if check is not None:
+                            check()
+                pending.popleft()
+                submit()
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        with self.lock:
+            self._shutdown()
+
+    def _shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
@@ -0,0 +1,35 @@
+import sys
+import time
+
+# main imports this before anything else so the imports are timed too
+enabled = False
+_last = time.perf_counter()
+_phases = []
+_reported = False
+
+def _print(phase, seconds):
+    print('startup: {:<20} {:8.1f} ms'.format(phase, seconds * 1000), 
+        file=sys.stderr)
+
+def mark(phase):
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+def record(phase, seconds):
+    # Phases that run in the background after the window is up
+    if not enabled:
+        return
+    if _reported:
+        _print(phase, seconds)
+    else:
+        _phases.append((phase, seconds))
+
+def report():
+    global _reported
+    if not enabled or _reported:
+        return
+    _reported = True
+    for phase, seconds in _phases:
+        _print(phase, seconds)
@@ -0,0 +1,89 @@
+import bisect
+import hashlib
+
+class _Descending(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+def _random_key(seed, values):
+    # Same seed and values always land in the same place, so rows appended
+    # later don't shuffle the rows already shown
+    return hashlib.md5(
+        '{}\0{}'.format(seed, '\0'.join(values)).encode('utf-8')
+    ).digest()
+
+def sort_key(sort, seed, row):
+    key = []
+    for direction, column in sort:
+        values = row.get(column)
+        if direction == 'asc':
+            key.append(values)
+        elif direction == 'desc':
+            key.append(_Descending(values))
+        elif direction == 'rand':
+            key.append(_random_key(seed, values))
+        else:
+            raise RuntimeError('Unknown sort direction {}'.format(direction))
+    return tuple(key)
+
+class ResultStore(object):
+    def __init__(self):
+        self.sort = []
+        self.seed = 0
+        self.rows = []
+        self.keys = []
+
+    def clear(self, seed=0):
+        self.seed = seed
+        self.rows = []
+        self.keys = []
+
+    def set_sort(self, sort):
+        self.sort = list(sort)
+        pairs = sorted(
+            zip(self._keys(self.rows), self.rows), key=lambda pair: pair[0])
+        self.keys = [pair[0] for pair in pairs]
+        self.rows = [pair[1] for pair in pairs]
+
+    def _keys(self, rows):
+        return [sort_key(self.sort, self.seed, row) for row in rows]
+
+    def plan(self, rows):
+        # (position, keys, rows) runs, last position first so applying one
+        # with insert doesn't shift the positions of the rest
+        pairs = sorted(zip(self._keys(rows), rows), key=lambda pair: pair[0])
+        runs = []
+        for key, row in pairs:
+            position = bisect.bisect_right(self.keys, key)
+            if runs and runs[-1][0] == position:
+                runs[-1][1].append(key)
+                runs[-1][2].append(row)
+            else:
+                runs.append((position, [key], [row]))
+        runs.reverse()
+        return runs
+
+    def insert(self, position, keys, rows):
+        self.keys[position:position] = keys
+        self.rows[position:position] = rows
+
+    def find(self, rows):
+        out = []
+        for key, row in zip(self._keys(rows), rows):
+            position = bisect.bisect_left(self.keys, key)
+            while self.rows[position] is not row:
+                position += 1
+            out.append(position)
+        return out
+
+    def delete(self, start, end):
+        del self.keys[start:end]
+        del self.rows[start:end]
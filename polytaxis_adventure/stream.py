@@ -0,0 +1,69 @@
+import threading
+
+class BatchSizer(object):
+    # Picks batch sizes so handling one on the GUI thread fits in about a
+    # frame.  Handling is timed in two parts: work per row, and work per
+    # batch (view relayout) which grows with the model rather than the batch.
+    # Once the per batch work alone is over budget, batches grow instead so
+    # it's at most half the time spent.
+    def __init__(self, first=20, maximum=5000, budget=0.016):
+        self.first = first
+        self.maximum = maximum
+        self.budget = budget
+        self.row_seconds = None
+        self.batch_seconds = 0
+
+    def size(self):
+        if not self.row_seconds:
+            return self.first
+        spare = max(self.budget - self.batch_seconds, self.batch_seconds)
+        return max(
+            self.first, 
+            min(self.maximum, int(spare / self.row_seconds)),
+        )
+
+    def measured(self, rows, seconds, batch_seconds=0):
+        if not rows:
+            return
+        sample = seconds / rows
+        if self.row_seconds is None:
+            self.row_seconds = sample
+            self.batch_seconds = batch_seconds
+        else:
+            self.row_seconds = self.row_seconds * 0.5 + sample * 0.5
+            self.batch_seconds = (
+                self.batch_seconds * 0.5 + batch_seconds * 0.5)
+
+class Stream(object):
+    # Batches from a worker job on their way to the GUI thread.  Only one
+    # notification is queued at a time; batches arriving before the GUI gets
+    # to it are merged, so a busy GUI catches up in one step rather than
+    # working through a backlog of signals.
+    def __init__(self, unique, sizer, notify):
+        self.unique = unique
+        self.sizer = sizer
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.pending = None
+        self.count = 0
+
+    def size(self):
+        # The first batch is kept small so something shows immediately
+        if not self.count:
+            return self.sizer.first
+        return self.sizer.size()
+
+    def put(self, rows):
+        with self.lock:
+            self.count += len(rows)
+            if self.pending is not None:
+                self.pending.extend(rows)
+                return
+            self.pending = list(rows)
+        self.notify.emit(self.unique, self)
+
+    def take(self):
+        with self.lock:
+            rows = self.pending
+            self.pending = None
+        return rows or []
@@ -0,0 +1,204 @@
+import array
+import threading
+
+# Tags added to rows by the pipeline or by add_path rather than stored in the
+# index
+derived_keys = {'path', 'filename'}
+
+def split_tag(tag):
+    key, separator, value = tag.partition('=')
+    if not separator:
+        return key, None
+    return key, value
+
+def has_tag(row, tag):
+    return row.has(*split_tag(tag))
+
+def split_path(path):
+    # Directory, with its trailing separator, and filename
+    directory, separator, filename = path.rpartition('/')
+    return directory + separator, filename
+
+class Strings(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.values = []
+
+    def id(self, value):
+        id = self.ids.get(value)
+        if id is not None:
+            return id
+        with self.lock:
+            id = self.ids.get(value)
+            if id is None:
+                id = len(self.values)
+                self.values.append(value)
+                self.ids[value] = id
+            return id
+
+# Tag keys and values for every table, interned once
+strings = Strings()
+
+# Path directories.  Paths aren't interned whole, since they're almost all
+# distinct, but as a shared directory and the filename tag.
+directories = Strings()
+
+no_path = 0xffffffff
+
+_filename = strings.id('filename')
+
+class Table(object):
+    # Row n's tags are the (key id, value id) pairs in keys/values from
+    # starts[n] to starts[n + 1], ordered by key id then value.  Its path is
+    # directories[n] and filenames[n], no_path if it has none.
+    __slots__ = ('starts', 'keys', 'values', 'directories', 'filenames')
+
+    def __init__(self):
+        self.starts = array.array('I', [0])
+        self.keys = array.array('I')
+        self.values = array.array('I')
+        self.directories = array.array('I')
+        self.filenames = array.array('I')
+
+    def add(self, tags):
+        pairs = [
+            (strings.id(key), value)
+            for key, values in tags.items()
+            if key not in derived_keys
+            for value in values
+        ]
+        path = tags.get('path')
+        if path:
+            directory, filename = split_path(next(iter(path)))
+            self.directories.append(directories.id(directory))
+            self.filenames.append(strings.id(filename))
+            pairs.append((_filename, filename))
+        else:
+            self.directories.append(no_path)
+            self.filenames.append(no_path)
+        pairs.sort()
+        for key, value in pairs:
+            self.keys.append(key)
+            self.values.append(strings.id(value))
+        self.starts.append(len(self.keys))
+        return Row(self, len(self.starts) - 2)
+
+    def add_interned(self, pairs, directory, filename):
+        # Like add, from (key id, value, value id) triples and the path's
+        # directory and filename ids
+        pairs = sorted(
+            pairs + [(_filename, strings.values[filename], filename)])
+        self.directories.append(directory)
+        self.filenames.append(filename)
+        for key, value, value_id in pairs:
+            self.keys.append(key)
+            self.values.append(value_id)
+        self.starts.append(len(self.keys))
+        return Row(self, len(self.starts) - 2)
+
+    def key_names(self):
+        out = {strings.values[key] for key in set(self.keys)}
+        if self.directories.count(no_path) != len(self.directories):
+            out.add('path')
+        return out
+
+def compact(rows):
+    table = Table()
+    return [table.add(row['tags']) for row in rows]
+
+class Row(object):
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def _span(self):
+        starts = self.table.starts
+        return range(starts[self.index], starts[self.index + 1])
+
+    def get(self, key):
+        if key == 'path':
+            if self.table.directories[self.index] == no_path:
+                return ()
+            return (self.path,)
+        key = strings.ids.get(key)
+        if key is None:
+            return ()
+        keys = self.table.keys
+        values = self.table.values
+        return tuple(
+            strings.values[values[pair]]
+            for pair in self._span()
+            if keys[pair] == key
+        )
+
+    def has(self, key, value=None):
+        if key == 'path':
+            path = self.get('path')
+            return bool(path) and (value is None or path[0] == value)
+        key = strings.ids.get(key)
+        if key is None:
+            return False
+        if value is not None:
+            value = strings.ids.get(value)
+            if value is None:
+                return False
+        keys = self.table.keys
+        values = self.table.values
+        for pair in self._span():
+            if keys[pair] == key and (value is None or values[pair] == value):
+                return True
+        return False
+
+    def pairs(self):
+        # Interned (key, value) ids, comparable between tables.  The path
+        # isn't included.
+        span = self._span()
+        return tuple(zip(
+            self.table.keys[span.start:span.stop], 
+            self.table.values[span.start:span.stop],
+        ))
+
+    def keys(self):
+        keys = self.table.keys
+        out = [
+            strings.values[key] 
+            for key in sorted({keys[pair] for pair in self._span()})
+        ]
+        if self.table.directories[self.index] != no_path:
+            out.append('path')
+        return out
+
+    def tags(self):
+        out = {}
+        for key in self.keys():
+            out[key] = set(self.get(key))
+        return out
+
+    @property
+    def directory(self):
+        directory = self.table.directories[self.index]
+        if directory == no_path:
+            return ''
+        return directories.values[directory]
+
+    @property
+    def filename(self):
+        filename = self.table.filenames[self.index]
+        if filename == no_path:
+            return ''
+        return strings.values[filename]
+
+    @property
+    def path_ids(self):
+        # Equal for rows with the same path, without building it
+        return (
+            self.table.directories[self.index], 
+            self.table.filenames[self.index],
+        )
+
+    @property
+    def path(self):
+        return self.directory + self.filename
@@ -0,0 +1,168 @@
+import array
+import bisect
+
+from .table import (
+    Table, derived_keys, directories, split_path, split_tag, strings,
+)
+
+# File ids matching each tag, built from the monitor's own per tag query
+# results so a tag means exactly what it does to the database.  Queries made
+# of known tags are then intersections and differences of sorted id lists.
+
+# Below this ratio of list lengths, filtering through a set of the longer list
+# beats searching it for each id
+_search_ratio = 8
+
+def intersect(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) <= len(a) * _search_ratio:
+        b = set(b)
+        return array.array('I', [id for id in a if id in b])
+    # Each search starts where the last one ended.  A galloping probe ahead
+    # first was measured slower, since bisect runs in C and the probe doesn't.
+    out = array.array('I')
+    position = 0
+    size = len(b)
+    search = bisect.bisect_left
+    for id in a:
+        position = search(b, id, position)
+        if position == size:
+            break
+        if b[position] == id:
+            out.append(id)
+            position += 1
+    return out
+
+def difference(a, b):
+    if len(b) <= len(a) * _search_ratio:
+        b = set(b)
+        return array.array('I', [id for id in a if id not in b])
+    out = array.array('I')
+    position = 0
+    size = len(b)
+    search = bisect.bisect_left
+    for id in a:
+        position = search(b, id, position)
+        if position == size or b[position] != id:
+            out.append(id)
+    return out
+
+class TagIndex(object):
+    # Only postings, each file's tags as tag numbers, and each file's path are
+    # kept, so no row is stored per file and a result's rows are built from
+    # its own files' tags.
+    def __init__(self):
+        self.postings = {}
+        # Tag numbers, and each number's (key id, value, value id) in result
+        # rows, None for derived keys
+        self.numbers = {}
+        self.pairs = []
+        # File ids by directory and filename id, and each id's path and tag
+        # numbers
+        self.ids = {}
+        self.directories = array.array('I')
+        self.filenames = array.array('I')
+        self.tags = []
+
+    def id(self, path):
+        directory, filename = split_path(path)
+        directory = directories.id(directory)
+        filename = strings.id(filename)
+        key = directory << 32 | filename
+        id = self.ids.get(key)
+        if id is None:
+            self.directories.append(directory)
+            self.filenames.append(filename)
+            self.tags.append(array.array('I'))
+            id = self.ids[key] = len(self.directories) - 1
+        return id
+
+    def number(self, tag, pair):
+        number = self.numbers.get(tag)
+        if number is None:
+            if strings.values[pair[0]] in derived_keys:
+                pair = None
+            self.pairs.append(pair)
+            number = self.numbers[tag] = len(self.pairs) - 1
+        return number
+
+    def set_posting(self, tag, posting):
+        # Files' tags follow the changes to the posting
+        old = self.postings.get(tag, array.array('I'))
+        number = self.numbers.get(tag)
+        if number is not None:
+            for id in difference(old, posting):
+                self.tags[id].remove(number)
+            for id in difference(posting, old):
+                self.tags[id].append(number)
+        if posting:
+            self.postings[tag] = posting
+        else:
+            self.postings.pop(tag, None)
+
+    def counts(self):
+        return {tag: len(posting) for tag, posting in list(self.postings.items())}
+
+    def query(self, includes, excludes):
+        # Ids in order, or None if the database has to answer.  Postings can
+        # be replaced or dropped by an update meanwhile, so each is read once.
+        if not includes:
+            # Files with no tags aren't in the index
+            return None
+        postings = self.postings
+        lists = []
+        for tag in list(includes) + list(excludes):
+            posting = postings.get(tag)
+            if posting is None or split_tag(tag)[0] in derived_keys:
+                return None
+            lists.append(posting)
+        excluded = lists[len(includes):]
+        lists = sorted(lists[:len(includes)], key=len)
+        ids = lists[0]
+        for other in lists[1:]:
+            if not ids:
+                break
+            ids = intersect(ids, other)
+        for other in excluded:
+            if not ids:
+                break
+            ids = difference(ids, other)
+        return ids
+
+    def rows(self, ids):
+        # Built as they're read
+        table = Table()
+        pairs = self.pairs
+        for id in ids:
+            yield table.add_interned(
+                [pairs[number] for number in self.tags[id] 
+                 if pairs[number] is not None],
+                self.directories[id], 
+                self.filenames[id],
+            )
+
+def _pair(tag, row):
+    key, value = split_tag(tag)
+    if value is None:
+        # The value the monitor gives a tag without one
+        values = row['tags'].get(key, ())
+        value = next(iter(values)) if len(values) == 1 else ''
+    return strings.id(key), value, strings.id(value)
+
+def update(index, db, tags, pause):
+    # Each tag's posting is queried again and replaced in place, so the index
+    # answers queries throughout, at worst a pass behind the database.  pause
+    # is called between tags, to wait for or stop at other work.
+    tags = set(tags)
+    for tag in list(index.postings):
+        if tag not in tags:
+            index.set_posting(tag, array.array('I'))
+    for tag in sorted(tags):
+        pause()
+        posting = set()
+        for row in db.query({tag}, set(), add_path=True):
+            if tag not in index.numbers:
+                index.number(tag, _pair(tag, row))
+            posting.add(index.id(next(iter(row['tags']['path']))))
+        index.set_posting(tag, array.array('I', sorted(posting)))
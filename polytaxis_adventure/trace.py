@@ -0,0 +1,154 @@
+import re
+import json
+import time
+import threading
+import traceback
+import collections
+
+# Stage timings for queries, recorded when tracing is on and written as
+# Chrome trace or plain JSON on exit
+
+enabled = False
+output = None
+output_format = 'chrome'
+
+max_plans = 200
+
+_start = time.perf_counter()
+_lock = threading.Lock()
+_threads = {}
+events = []
+plans = collections.OrderedDict()
+
+def configure(path=None, format='chrome', panel=False):
+    global enabled, output, output_format
+    if format not in ('chrome', 'json'):
+        raise RuntimeError('Unknown trace format {}'.format(format))
+    output = path
+    output_format = format
+    enabled = bool(path) or panel
+
+def now():
+    return (time.perf_counter() - _start) * 1000000
+
+def _thread():
+    thread = threading.current_thread()
+    if thread.ident not in _threads:
+        _threads[thread.ident] = thread.name
+    return thread.ident
+
+def complete(name, start, category='query', **args):
+    if not enabled:
+        return
+    end = now()
+    with _lock:
+        events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': end - start,
+            'tid': _thread(),
+            'args': args,
+        })
+
+def event(name, category='query', **args):
+    if not enabled:
+        return
+    with _lock:
+        events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'i',
+            's': 't',
+            'ts': now(),
+            'tid': _thread(),
+            'args': args,
+        })
+
+class _Span(object):
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, *pargs):
+        complete(self.name, self.start, self.category, **self.args)
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *pargs):
+        pass
+
+_no_span = _NoSpan()
+
+def span(name, category='query', **args):
+    if not enabled:
+        return _no_span
+    return _Span(name, category, args)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def statement(sql, explain):
+    # Called with each statement the query connections run; plans are
+    # looked up once per statement shape
+    key = _literals.sub('?', sql)
+    with _lock:
+        plan = plans.get(key)
+        if plan is not None:
+            plan['count'] += 1
+            return
+        if len(plans) >= max_plans:
+            return
+        plan = plans[key] = {'sql': sql, 'count': 1, 'plan': None}
+    try:
+        plan['plan'] = explain(sql)
+    except Exception:
+        plan['plan'] = traceback.format_exc().splitlines()[-1:]
+
+def dump():
+    if not output:
+        return
+    with _lock:
+        out_events = list(events)
+        out_plans = list(plans.values())
+    if output_format == 'chrome':
+        data = {
+            'traceEvents': [
+                dict(event, pid=1) for event in out_events
+            ] + [
+                {
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': 1,
+                    'tid': tid,
+                    'args': {'name': name},
+                }
+                for tid, name in _threads.items()
+            ],
+            'displayTimeUnit': 'ms',
+            'queryPlans': out_plans,
+        }
+    else:
+        data = {
+            'events': [
+                {
+                    'name': event['name'],
+                    'category': event['cat'],
+                    'thread': _threads.get(event['tid']),
+                    'start_ms': event['ts'] / 1000,
+                    'duration_ms': event.get('dur', 0) / 1000,
+                    'args': event['args'],
+                }
+                for event in out_events
+            ],
+            'plans': out_plans,
+        }
+    with open(output, 'w') as out:
+        json.dump(data, out, indent=1)
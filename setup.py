@@ -23,7 +23,7 @@ setup(
     ],
     entry_points = {
         'console_scripts': [
-            'polytaxis-adventure = polytaxis_adventure.main:main',
+            'polytaxis-adventure = polytaxis_adventure.cli:main',
         ],
     },
     include_package_resources=True,